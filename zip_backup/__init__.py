@@ -1,19 +1,34 @@
+import time
+PLUGIN_IMPORT_TIME = time.time()  # 用于统计插件加载耗时
+
 import collections
 import os
 import shutil
-import time
-import zipfile
+import tempfile
 import threading
 from threading import Lock, Event
-from typing import List, Dict, Optional
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
+from typing import TYPE_CHECKING, Any, List, Dict, NamedTuple, Optional, Tuple
 import json
-from tqdm import tqdm
 
 from mcdreforged.api.all import *
 
+from zip_backup.activity import ActivityTracker
+from zip_backup.forecast import BackupHistory, Forecast
+from zip_backup.host_lock import HostSemaphore
+from zip_backup.region import is_region_file, write_mapped_to_zip
+from zip_backup.progress import ProgressReporter, ProgressSnapshot, ProgressTracker, step_filter
+from zip_backup.storage import UPLOAD_STATE_SUFFIX, BACKENDS, StorageBackend, create_backend
+
+# apscheduler 和压缩库只在第一次用到时才导入，以加快插件的加载和重载
+if TYPE_CHECKING:
+    from apscheduler.triggers.cron import CronTrigger
+
+
+def get_compression_method_of(level: str) -> int:
+    """压缩等级对应的压缩方法"""
+    import zipfile
+    return zipfile.ZIP_STORED if level == 'speed' else zipfile.ZIP_LZMA
+
 
 class Configure(Serializable):
     turn_off_auto_save: bool = True
@@ -31,11 +46,58 @@ class Configure(Serializable):
     auto_backup_unit: str = 's'  # 时间单位，可选值：'s', 'm', 'h', 'd'
     # 日期模式配置
     auto_backup_date_type: str = 'daily'  # 日期类型：'monthly', 'weekly', 'daily'
+    auto_backup_date_offset: int = 0  # 在凌晨1点的基础上固定推迟的秒数（可为负数，不超过一天），用于错开同一主机上的多个实例
+    auto_backup_date_jitter: int = 0  # 在固定时间的基础上再随机推迟的最大秒数
     compression_level: str = 'best'  # 压缩等级：'speed' 或 'best'
+    # 归档相关配置
+    archive_mode: str = 'single'  # 归档模式：'single'(所有世界一个压缩包), 'per_world'(每个世界单独一个压缩包，同时进行)
+    max_parallel_per_disk: int = 1  # per_world 模式下同一块磁盘上同时压缩的世界数量
+    # 备份前检查相关配置
+    preflight_enabled: bool = True  # 是否在备份前预测压缩包大小并检查磁盘空间
+    preflight_action: str = 'refuse'  # 磁盘空间不足时：'refuse'(取消备份), 'prune'(删除最旧的备份腾出空间，需要手动开启)
+    preflight_keep_backups: int = 3  # 清理时至少保留的最新备份数量，per_world 模式下每个世界分别计算
+    preflight_switch_codec: bool = True  # 是否允许为了节省空间或时间自动切换本次备份的压缩等级
+    preflight_max_duration: int = 0  # 预计压缩耗时超过该秒数时改用最快速度压缩，0 为不限制
+    mmap_region_files: bool = True  # 通过内存映射读取区域文件(.mca/.mcc)，仅在 turn_off_auto_save 开启时生效
+    world_overrides: Dict[str, Dict[str, Any]] = {}  # per_world 模式下单个世界的配置，可覆盖 compression_level 和定时相关配置
+    # 智能调度相关配置
+    smart_schedule_enabled: bool = False  # 到点时如果服务器繁忙则推迟备份
+    smart_max_players: int = 0  # 在线人数不超过该值时视为空闲
+    smart_lag_window: int = 300  # 统计卡顿警告的时间窗口（秒）
+    smart_max_lag_warnings: int = 0  # 时间窗口内的卡顿警告不超过该次数时视为空闲
+    smart_max_delay: int = 3600  # 最多推迟的秒数，超过后无论是否繁忙都会开始备份
+    smart_check_interval: int = 30  # 推迟期间检查服务器状态的间隔（秒）
     # 备份文件移动相关配置
     move_after_backup: bool = False  # 是否在备份后移动文件
-    move_to_path: str = './backup_archive'  # 移动目标路径
+    move_to_path: str = './backup_archive'  # 移动目标路径（本地或 NFS 挂载目录）
     delete_after_move: bool = False  # 是否在移动后删除原文件
+    move_backend: str = 'local'  # 移动目标类型：'local'(本地/NFS), 'sftp', 's3'
+    sftp_options: Dict[str, Any] = {
+        'host': '',
+        'port': 22,
+        'username': '',
+        'password': '',
+        'key_file': '',
+        'path': './backup_archive'
+    }
+    s3_options: Dict[str, Any] = {
+        'endpoint_url': '',  # 使用 MinIO 等兼容服务时填写，如 http://127.0.0.1:9000
+        'bucket': '',
+        'prefix': 'zip_backup',
+        'access_key': '',
+        'secret_key': '',
+        'region': ''
+    }
+    upload_part_size: int = 16  # 分块上传的块大小（MB）
+    upload_concurrency: int = 4  # 同时上传的块数量
+    # 同一主机多实例协调相关配置
+    host_lock_enabled: bool = False  # 是否与同一主机上的其他实例协调备份
+    host_lock_path: str = os.path.join(tempfile.gettempdir(), 'mcdr_zip_backup')  # 所有实例共享的锁目录
+    host_max_concurrent_backups: int = 1  # 同一主机上同时压缩的备份数量上限
+    # 进度显示相关配置
+    progress_interval: float = 5.0  # 进度报告间隔（秒）
+    progress_console: bool = True  # 是否在控制台显示进度
+    progress_display: str = 'actionbar'  # 发起备份的玩家看到的进度：'actionbar'(动作栏), 'chat'(聊天栏), 'none'(不显示)
 
     minimum_permission_level: Dict[str, int] = {
         'make': 2,
@@ -47,15 +109,67 @@ class Configure(Serializable):
         'time.interval': 3,
         'time.date': 3,
         'time.change': 3,
+        'time.smart': 3,
         'ziplevel': 3,
+        'archive': 3,
         'move.enable': 3,
         'move.disable': 3,
-        'move.path': 3
+        'move.path': 3,
+        'move.backend': 3,
+        'move.retry': 3
     }
 
-    def get_compression_method(self) -> int:
+    def get_world_setting(self, world: Optional[str], key: str) -> Any:
+        """获取某个世界的配置，per_world 模式下优先使用 world_overrides 中的值"""
+        if world is not None and self.archive_mode == 'per_world':
+            override = self.world_overrides.get(world, {})
+            if key in override:
+                return override[key]
+        return getattr(self, key)
+
+    def get_compression_level(self, world: Optional[str] = None) -> str:
+        return self.get_world_setting(world, 'compression_level')
+
+    def get_compression_method(self, world: Optional[str] = None) -> int:
         """获取实际的压缩方法"""
-        return zipfile.ZIP_STORED if self.compression_level == 'speed' else zipfile.ZIP_LZMA
+        return get_compression_method_of(self.get_compression_level(world))
+
+    def is_date_offset_valid(self) -> bool:
+        """固定偏移只能在前后一天以内，超出时忽略"""
+        return abs(self.auto_backup_date_offset) < 86400
+
+    def get_date_schedule(self) -> Tuple[int, int]:
+        """日期模式实际的备份时间：(相对于原定日期顺延的天数，为 -1、0 或 1, 当天的第几秒)"""
+        offset = self.auto_backup_date_offset if self.is_date_offset_valid() else 0
+        days, seconds = divmod(3600 + offset, 86400)
+        return days, seconds
+
+    def get_date_time_text(self) -> str:
+        """日期模式下的备份时间描述"""
+        days, seconds = self.get_date_schedule()
+        if days == 0 and seconds == 3600:
+            text = '凌晨1点'
+        else:
+            text = '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+        if self.auto_backup_date_type != 'daily' and days != 0:
+            text += '（顺延到第二天）' if days > 0 else '（提前到前一天）'
+        if self.auto_backup_date_jitter > 0:
+            text += f'（随机推迟最多{self.auto_backup_date_jitter}秒）'
+        return text
+
+    def create_storage_backend(self) -> StorageBackend:
+        """根据配置创建备份移动使用的存储后端"""
+        if self.move_backend == 'sftp':
+            options = dict(self.sftp_options)
+        elif self.move_backend == 's3':
+            options = dict(self.s3_options)
+        else:
+            options = {'path': self.move_to_path}
+        return create_backend(
+            self.move_backend, options,
+            part_size=self.upload_part_size * 2 ** 20,
+            concurrency=self.upload_concurrency
+        )
 
     def save(self):
         config_file_path = os.path.join('config', 'zip_backup.json')
@@ -68,6 +182,8 @@ auto_backup_timer = None  # 定时器引用，用于取消任务
 config: Configure
 Prefix = '!!zb'
 CONFIG_FILE = os.path.join('config', 'zip_backup.json')
+HISTORY_FILE = os.path.join('config', 'zip_backup_history.json')  # 历史备份的大小和耗时，用于预测
+PREFLIGHT_SAFETY_FACTOR = 1.1  # 检查磁盘空间时在预测大小的基础上多留的余量
 HelpMessage = '''
 §b ______  _         ____                  _                
 §b|__  / |(_)_ __   | __ )    __ _   ___ | | __ _   _ _ __  
@@ -81,21 +197,39 @@ HelpMessage = '''
 §7{0} listall§r 列出所有备份
 §7{0} stats§r 显示备份状态信息
 §7{0} ziplevel <等级>§r §r设置压缩等级。§7[<等级>]§r可选speed(最快速度),best(最佳压缩比)
+§7{0} archive <模式>§r §r设置归档模式。§7[<模式>]§r可选single(所有世界一个压缩包),per_world(每个世界单独打包)
 §7{0} time enable§r 启动自动备份
 §7{0} time disable§r 关闭自动备份
 §7{0} time interval <时间间隔> <单位>§r §r设置自动备份时间间隔。§7[<单位>]§r可选s(秒）,m(分）,h(时),d(天)
 §7{0} time date <类型>§r §r设置自动备份日期类型。§7[<类型>]§r可选monthly(每月),weekly(每周),daily(每天)
 §7{0} time change <模式>§r §r切换备份模式。§7[<模式>]§r可选interval(间隔),date(日期)
+§7{0} time smart enable§r 启用智能调度，服务器繁忙时推迟自动备份
+§7{0} time smart disable§r 关闭智能调度
 §7{0} move enable§r 启用备份后移动功能
 §7{0} move disable§r 禁用备份后移动功能
 §7{0} move path <路径>§r 设置备份移动目标路径
+§7{0} move backend <类型>§r 设置备份移动目标类型。§7[<类型>]§r可选local(本地/NFS),sftp,s3
+§7{0} move retry§r 继续上传之前中断的备份文件
 §a小草神什么的最可爱拉！(◕ᴗ◕✿)§r
 '''.strip().format(Prefix)
-game_saved = False
+game_saved = Event()
 plugin_unloaded = False
+unload_time = 0.0
+RELOAD_GRACE_PERIOD = 10  # 卸载后等待新实例接管的秒数，超时仍未被接管才视为插件真正被卸载
+load_duration: Optional[float] = None  # 上一次插件加载的耗时（秒）
 creating_backup = Lock()
+backup_queue_lock = Lock()  # 保证“备份锁被占用时排队”和“释放备份锁时取出队列”不会交错
+queued_backup_worlds: List[str] = []  # 到点时正在备份而排队的世界，当前备份结束后紧接着备份
 scheduler = None
 server_inst = None
+activity = ActivityTracker()  # 在线人数和卡顿统计，供智能调度使用
+ACTIVITY_SAMPLE_INTERVAL = 300  # 统计各时段在线人数的间隔（秒）
+host_semaphore: Optional[HostSemaphore] = None  # 正在使用的主机级备份名额
+current_progress: Optional[ProgressReporter] = None  # 正在进行的压缩或上传进度
+last_progress: Optional[ProgressSnapshot] = None  # 最近一次完成的进度
+backup_history: Optional[BackupHistory] = None  # 第一次用到时才从 HISTORY_FILE 读取
+last_forecast: Optional[Forecast] = None  # 最近一次备份前的预测
+last_result: Optional[Forecast] = None  # 最近一次备份的实际结果
 
 # 插件加载时显示的字符画
 PLUGIN_LOADED_ART = r'''
@@ -131,72 +265,102 @@ def touch_backup_folder():
         os.makedirs(config.backup_path)
 
 
-def zip_world(server: ServerInterface, comment: Optional[str] = None):
-    """压缩世界文件"""
-    # 获取总文件大小和数量
+def start_progress(server: ServerInterface, title: str, total: int, player: Optional[str] = None) -> ProgressReporter:
+    """开始报告一个阶段的进度，输出到控制台、发起备份的玩家以及 !!zb stats"""
+    global current_progress
+    sinks = []
+    if config.progress_console:
+        sinks.append(lambda snapshot: server.logger.info(snapshot.format()))
+    if player is not None:
+        if config.progress_display == 'actionbar':
+            sinks.append(lambda snapshot: server.execute('title {} actionbar {}'.format(
+                player, json.dumps({'text': snapshot.format()}, ensure_ascii=False)
+            )))
+        elif config.progress_display == 'chat':
+            sinks.append(step_filter(lambda snapshot: server.tell(player, '[zip_backup] ' + snapshot.format()), 10))
+    current_progress = ProgressReporter(ProgressTracker(title, total), config.progress_interval, sinks).start()
+    return current_progress
+
+
+def finish_progress(reporter: ProgressReporter):
+    """结束进度报告，并保留最终结果供 !!zb stats 查看"""
+    global current_progress, last_progress
+    reporter.stop()
+    last_progress = reporter.snapshot
+    if current_progress is reporter:
+        current_progress = None
+
+
+def iter_world_files(world: str):
+    """
+    遍历世界文件夹中需要备份的文件
+    world_names 中也可以填写维度文件夹（如 world/DIM-1），此时它不会再被包含在所在的世界里
+    """
+    world_path = os.path.join(config.server_path, world)
+    if not os.path.exists(world_path):
+        return
+    nested_worlds = {os.path.normpath(os.path.join(config.server_path, name)) for name in config.world_names}
+    for root, dirs, files in os.walk(world_path):
+        dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(root, d)) not in nested_worlds]
+        for file in files:
+            # 跳过 session.lock 文件
+            if file == 'session.lock':
+                continue
+            yield os.path.join(root, file)
+
+
+def get_worlds_size(worlds: List[str]) -> int:
+    """获取世界文件的总大小"""
     total_size = 0
-    file_count = 0
-    for world in config.world_names:
-        world_path = os.path.join(config.server_path, world)
-        if not os.path.exists(world_path):
-            continue
-        for root, _, files in os.walk(world_path):
-            for file in files:
-                # 跳过 session.lock 文件
-                if file == 'session.lock':
-                    continue
-                file_path = os.path.join(root, file)
-                if os.path.exists(file_path):
-                    try:
-                        total_size += os.path.getsize(file_path)
-                        file_count += 1
-                    except OSError:
-                        continue
-
-    # 准备压缩
-    timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
-    zip_file = os.path.join(config.backup_path, f'backup_{timestamp}.zip')
-    
-    # 确保备份目录存在
+    for world in worlds:
+        for file_path in iter_world_files(world):
+            try:
+                total_size += os.path.getsize(file_path)
+            except OSError:
+                continue
+    return total_size
+
+
+class ArchiveTask(NamedTuple):
+    zip_file: str
+    worlds: List[str]
+    level: str  # 压缩等级
+    size: int  # 待压缩文件的总大小
+
+    @property
+    def key(self) -> str:
+        """用于在历史记录中区分不同的世界组合"""
+        return ','.join(self.worlds)
+
+
+def write_archive(server: ServerInterface, task: ArchiveTask, comment: Optional[str], progress: ProgressReporter):
+    """把若干个世界写入同一个压缩包并记录大小和耗时，失败时删除未完成的文件"""
+    import zipfile
+    zip_file, worlds, compression = task.zip_file, task.worlds, get_compression_method_of(task.level)
+    start_time = time.time()
+    # 映射期间文件被截断会导致进程崩溃，所以只在服务端停止自动保存时才使用内存映射
+    use_mmap = config.mmap_region_files and config.turn_off_auto_save
     try:
-        os.makedirs(config.backup_path, exist_ok=True)
-    except PermissionError as e:
-        server.logger.error(f"无法创建备份目录: {str(e)}")
-        raise
-
-    # 创建进度条
-    progress = tqdm(total=total_size, unit='B', unit_scale=True, 
-                   desc='压缩进度', ncols=100, 
-                   bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]')
-
-    try:
-        with zipfile.ZipFile(zip_file, 'w', config.get_compression_method()) as zf:
+        with zipfile.ZipFile(zip_file, 'w', compression) as zf:
             # 添加注释
             if comment:
                 zf.comment = comment.encode()
 
             # 遍历所有世界文件夹
-            for world in config.world_names:
-                world_path = os.path.join(config.server_path, world)
-                if not os.path.exists(world_path):
-                    continue
-
-                for root, _, files in os.walk(world_path):
-                    for file in files:
-                        # 跳过 session.lock 文件
-                        if file == 'session.lock':
-                            continue
-                        file_path = os.path.join(root, file)
-                        if os.path.exists(file_path):
-                            try:
-                                # 计算相对路径
-                                arcname = os.path.relpath(file_path, config.server_path)
-                                # 写入文件并更新进度条
-                                zf.write(file_path, arcname)
-                                progress.update(os.path.getsize(file_path))
-                            except (OSError, PermissionError) as e:
-                                server.logger.warning(f"跳过文件 {file_path}: {str(e)}")
-                                continue
+            for world in worlds:
+                for file_path in iter_world_files(world):
+                    try:
+                        # 计算相对路径
+                        arcname = os.path.relpath(file_path, config.server_path)
+                        # 写入文件并累加进度
+                        if use_mmap and is_region_file(file_path):
+                            write_mapped_to_zip(zf, file_path, arcname, compression, progress.tracker.add)
+                        else:
+                            zf.write(file_path, arcname)
+                            progress.tracker.add(os.path.getsize(file_path))
+                    except (OSError, PermissionError) as e:
+                        server.logger.warning(f"跳过文件 {file_path}: {str(e)}")
+                        continue
 
     except Exception as e:
         # 如果压缩失败，删除未完成的文件
@@ -206,84 +370,391 @@ def zip_world(server: ServerInterface, comment: Optional[str] = None):
         except:
             pass
         raise
-    finally:
-        progress.close()
 
+    try:
+        get_backup_history().record(task.key, task.level, task.size, os.path.getsize(zip_file), time.time() - start_time)
+    except OSError as e:
+        server.logger.warning(f'保存备份历史记录失败：{str(e)}')
 
-def move_backup_file(server: ServerInterface, backup_file: str):
-    """移动备份文件到指定目录"""
+
+def get_archive_plan(worlds: List[str], zip_file: Optional[str] = None) -> List[ArchiveTask]:
+    """根据归档模式决定要生成哪些压缩包，同时统计每个压缩包的原始大小"""
+    timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
+    if config.archive_mode == 'per_world':
+        plan = []
+        for world in worlds:
+            zip_file = os.path.join(config.backup_path, f'backup_{timestamp}_{get_world_file_suffix(world)}.zip')
+            plan.append(ArchiveTask(zip_file, [world], config.get_compression_level(world), get_worlds_size([world])))
+        return plan
+    if zip_file is None:
+        zip_file = os.path.join(config.backup_path, f'backup_{timestamp}.zip')
+    return [ArchiveTask(zip_file, worlds, config.get_compression_level(), get_worlds_size(worlds))]
+
+
+def get_world_file_suffix(world: str) -> str:
+    """per_world 模式下压缩包文件名中的世界名，维度文件夹（如 world/DIM-1）中的分隔符换成下划线"""
+    return format_file_name(world.replace('/', '_').replace('\\', '_'))
+
+
+def zip_world(server: ServerInterface, comment: Optional[str] = None, zip_file: Optional[str] = None, player: Optional[str] = None,
+              worlds: Optional[List[str]] = None, plan: Optional[List[ArchiveTask]] = None) -> Tuple[List[str], List[str]]:
+    """
+    压缩世界文件，返回 (生成的压缩包路径列表, 压缩失败的世界列表)
+    per_world 模式下部分世界失败时仍然返回其余成功的压缩包，全部失败时抛出异常
+    """
+    global last_result
+    if worlds is None:
+        worlds = config.world_names
+    if plan is None:
+        plan = get_archive_plan(worlds, zip_file)
+
+    # 确保备份目录存在
+    try:
+        os.makedirs(config.backup_path, exist_ok=True)
+    except PermissionError as e:
+        server.logger.error(f"无法创建备份目录: {str(e)}")
+        raise
+
+    start_time = time.time()
+    progress = start_progress(server, '压缩进度', sum(task.size for task in plan), player)
+    failed = []
+    try:
+        if len(plan) == 1:
+            write_archive(server, plan[0], comment, progress)
+        else:
+            failed = write_archives_parallel(server, plan, comment, progress)
+    finally:
+        finish_progress(progress)
+
+    succeeded = [task for task in plan if task not in failed]
+    output_size = sum(os.path.getsize(task.zip_file) for task in succeeded)
+    last_result = Forecast(sum(task.size for task in succeeded), output_size, time.time() - start_time, 0)
+    return [task.zip_file for task in succeeded], [world for task in failed for world in task.worlds]
+
+
+def write_archives_parallel(server: ServerInterface, plan: List[ArchiveTask], comment: Optional[str], progress: ProgressReporter) -> List[ArchiveTask]:
+    """
+    同时生成多个压缩包，同一块磁盘上同时读取的世界数量不超过 max_parallel_per_disk
+    返回生成失败的任务，全部失败时抛出第一个错误
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    disk_semaphores: Dict[int, threading.Semaphore] = {}
+    for task in plan:
+        disk = get_world_disk_id(task)
+        if disk not in disk_semaphores:
+            disk_semaphores[disk] = threading.Semaphore(max(1, config.max_parallel_per_disk))
+
+    def run(task: ArchiveTask):
+        with disk_semaphores[get_world_disk_id(task)]:
+            write_archive(server, task, comment, progress)
+
+    failed, errors = [], []
+    with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix='Zip-Backup-World') as pool:
+        futures = [(task, pool.submit(run, task)) for task in plan]
+        for task, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                server.logger.error(f'生成压缩文件 {os.path.basename(task.zip_file)} 失败：{str(e)}')
+                failed.append(task)
+                errors.append(e)
+    if len(failed) == len(plan):
+        raise errors[0]
+    return failed
+
+
+def get_disk_id(path: str) -> int:
+    """路径所在的设备号，用于区分不同的磁盘，路径还不存在时使用最近的已存在的上级目录"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return -1
+            path = parent
+
+
+def get_world_disk_id(task: ArchiveTask) -> int:
+    return get_disk_id(os.path.join(config.server_path, task.worlds[0]))
+
+
+def get_backup_history() -> BackupHistory:
+    global backup_history
+    if backup_history is None:
+        backup_history = BackupHistory(HISTORY_FILE)
+    return backup_history
+
+
+def forecast_plan(plan: List[ArchiveTask]) -> Forecast:
+    """预测整个备份计划的压缩包总大小和耗时，per_world 模式下考虑同时压缩的数量"""
+    history = get_backup_history()
+    forecast = Forecast(0, 0, 0.0, 0)
+    for task in plan:
+        forecast = forecast + history.estimate(task.key, task.level, task.size)
+    if len(plan) > 1:
+        disks = {get_world_disk_id(task) for task in plan}
+        parallel = min(len(plan), len(disks) * max(1, config.max_parallel_per_disk))
+        forecast = forecast._replace(duration=forecast.duration / parallel)
+    return forecast
+
+
+def get_space_shortages(output_bytes: int) -> List[tuple]:
+    """检查备份目录和（本地）移动目标所在磁盘的剩余空间，返回空间不足的 (路径, 需要的字节数, 剩余字节数) 列表"""
+    requirements: Dict[int, list] = {}  # 设备号 -> [路径, 需要的字节数]
+    paths = [config.backup_path]
+    if config.move_after_backup and config.move_backend == 'local':
+        paths.append(config.move_to_path)
+    for path in paths:
+        disk = get_disk_id(path)
+        requirements.setdefault(disk, [path, 0])[1] += int(output_bytes * PREFLIGHT_SAFETY_FACTOR)
+
+    shortages = []
+    for path, required in requirements.values():
+        existing = os.path.abspath(path)
+        while not os.path.exists(existing) and os.path.dirname(existing) != existing:
+            existing = os.path.dirname(existing)
+        free = shutil.disk_usage(existing).free
+        if free < required:
+            shortages.append((path, required, free))
+    return shortages
+
+
+def get_backup_group(name: str) -> str:
+    """
+    备份文件所属的分组：per_world 模式下为文件名中的世界名，其余备份为空字符串
+    文件名格式为 backup_<时间>.zip 或 backup_<时间>_<世界名>.zip
+    """
+    suffix = name[len('backup_') + len('0000-00-00_00-00-00'): -len('.zip')].lstrip('_')
+    if suffix in {get_world_file_suffix(world) for world in config.world_names}:
+        return suffix
+    return ''
+
+
+def prune_old_backups(source: CommandSource, required: int) -> int:
+    """
+    从最旧的备份开始删除，直到备份目录所在磁盘有足够的剩余空间，返回删除的数量
+    每个分组（每个世界单独的压缩包，或者包含所有世界的压缩包）都至少保留 preflight_keep_backups 个最新的备份
+    """
+    groups: Dict[str, List[str]] = {}
+    for name in os.listdir(config.backup_path):
+        file_name = os.path.join(config.backup_path, name)
+        # 还没上传完的备份不能删除
+        if name.startswith('backup_') and name.endswith('.zip') and os.path.isfile(file_name) \
+                and not os.path.exists(file_name + UPLOAD_STATE_SUFFIX):
+            groups.setdefault(get_backup_group(name), []).append(file_name)
+    backups = []
+    for group in groups.values():
+        group.sort(key=os.path.getmtime)
+        backups.extend(group[: max(0, len(group) - config.preflight_keep_backups)])
+    backups.sort(key=os.path.getmtime)
+    removed = 0
+    for file_name in backups:
+        if shutil.disk_usage(config.backup_path).free >= required:
+            break
+        os.remove(file_name)
+        removed += 1
+        info_message(source, f'磁盘空间不足，已删除旧备份§e{os.path.basename(file_name)}§r')
+    return removed
+
+
+def preflight_check(source: CommandSource, plan: List[ArchiveTask]) -> Optional[List[ArchiveTask]]:
+    """
+    备份前预测压缩包大小和耗时并检查磁盘空间
+    必要时切换本次备份的压缩等级或清理旧备份，返回（可能调整过的）备份计划，空间仍然不足时返回 None
+    """
+    global last_forecast
+    os.makedirs(config.backup_path, exist_ok=True)
+    forecast = forecast_plan(plan)
+    shortages = get_space_shortages(forecast.output_bytes)
+
+    if config.preflight_switch_codec:
+        level = None
+        if len(shortages) > 0 and any(task.level != 'best' for task in plan):
+            level = 'best'  # 空间不足时改用压缩比更高的等级
+        elif len(shortages) == 0 and 0 < config.preflight_max_duration < forecast.duration and any(task.level != 'speed' for task in plan):
+            level = 'speed'  # 耗时太长时改用最快速度，但前提是空间足够
+        if level is not None:
+            new_plan = [task._replace(level=level) for task in plan]
+            new_forecast = forecast_plan(new_plan)
+            new_shortages = get_space_shortages(new_forecast.output_bytes)
+            if level == 'best' or len(new_shortages) == 0:
+                level_names = {'speed': '最快速度', 'best': '最佳压缩比(LZMA)'}
+                info_message(source, f'本次备份改用§6{level_names[level]}§r压缩', broadcast=True)
+                plan, forecast, shortages = new_plan, new_forecast, new_shortages
+
+    if len(shortages) > 0 and config.preflight_action == 'prune':
+        backup_disk = get_disk_id(config.backup_path)
+        for path, required, _ in shortages:
+            if get_disk_id(path) == backup_disk:
+                prune_old_backups(source, required)
+        shortages = get_space_shortages(forecast.output_bytes)
+
+    last_forecast = forecast
+    if len(shortages) > 0:
+        for path, required, free in shortages:
+            info_message(source, '§c磁盘空间不足：{} 需要约{}MB，剩余{}MB§r'.format(
+                path, round(required / 2 ** 20, 1), round(free / 2 ** 20, 1)
+            ), broadcast=True)
+        return None
+    info_message(source, '预计压缩包大小约§e{}MB§r，耗时约§e{}秒§r'.format(
+        round(forecast.output_bytes / 2 ** 20, 1), round(forecast.duration, 1)
+    ), broadcast=True)
+    return plan
+
+
+def move_backup_file(server: ServerInterface, backup_files: List[str], player: Optional[str] = None):
+    """移动备份文件到配置的存储后端"""
     if not config.move_after_backup:
         return
-    
+
+    try:
+        backend = config.create_storage_backend()
+    except Exception as e:
+        server.logger.error(f'创建存储后端失败：{str(e)}')
+        return
+
+    try:
+        # 先继续上传之前中断的备份文件
+        for pending_file in get_pending_uploads():
+            if pending_file not in backup_files:
+                upload_backup_file(server, backend, pending_file, player)
+        for backup_file in backup_files:
+            if os.path.isfile(backup_file):
+                upload_backup_file(server, backend, backup_file, player)
+    finally:
+        backend.close()
+
+
+def upload_backup_file(server: ServerInterface, backend: StorageBackend, backup_file: str, player: Optional[str] = None) -> bool:
+    """通过存储后端上传单个备份文件，失败时保留续传记录"""
     try:
-        # 确保目标目录存在
-        os.makedirs(config.move_to_path, exist_ok=True)
-        
-        # 获取文件名和大小
-        file_name = os.path.basename(backup_file)
         file_size = os.path.getsize(backup_file)
-        target_path = os.path.join(config.move_to_path, file_name)
-        
-        # 创建进度条
-        progress = tqdm(total=file_size, unit='B', unit_scale=True,
-                       desc='移动文件', ncols=100,
-                       bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]')
 
-        # 使用分块读写来移动文件，以便显示进度
+        progress = start_progress(server, '移动文件', file_size, player)
         try:
-            with open(backup_file, 'rb') as src, open(target_path, 'wb') as dst:
-                while True:
-                    chunk = src.read(8192)  # 8KB 缓冲区
-                    if not chunk:
-                        break
-                    dst.write(chunk)
-                    progress.update(len(chunk))
-            
-            # 根据配置决定是否删除源文件
-            if config.delete_after_move:
-                os.remove(backup_file)
-                server.logger.info(f'备份文件已移动到：{target_path} 并删除原文件')
-            else:
-                server.logger.info(f'备份文件已复制到：{target_path}')
-            
-        except Exception as e:
-            # 如果移动过程中出错，清理目标文件
-            if os.path.exists(target_path):
-                os.remove(target_path)
-            raise e
+            target_path = backend.upload(backup_file, on_progress=progress.tracker.add)
         finally:
-            progress.close()
-            
+            finish_progress(progress)
+
+        # 根据配置决定是否删除源文件
+        if config.delete_after_move:
+            os.remove(backup_file)
+            server.logger.info(f'备份文件已移动到：{target_path} 并删除原文件')
+        else:
+            server.logger.info(f'备份文件已复制到：{target_path}')
+        return True
+
     except Exception as e:
         server.logger.error(f'移动备份文件失败：{str(e)}')
+        if os.path.exists(backup_file + UPLOAD_STATE_SUFFIX):
+            server.logger.info(f'已保存上传进度，可使用 {Prefix} move retry 继续上传')
+        return False
+
+
+def get_pending_uploads() -> List[str]:
+    """获取上传中断、等待续传的备份文件"""
+    result = []
+    if not os.path.isdir(config.backup_path):
+        return result
+    for name in sorted(os.listdir(config.backup_path)):
+        if not name.endswith(UPLOAD_STATE_SUFFIX):
+            continue
+        state_file = os.path.join(config.backup_path, name)
+        backup_file = state_file[: -len(UPLOAD_STATE_SUFFIX)]
+        if os.path.isfile(backup_file):
+            result.append(backup_file)
+        else:
+            # 备份文件已经不存在，续传记录没有意义了
+            os.remove(state_file)
+    return result
+
+
+@new_thread('Zip-Backup-Upload')
+def retry_pending_uploads(source: CommandSource):
+    """继续上传之前中断的备份文件"""
+    pending = get_pending_uploads()
+    if len(pending) == 0:
+        source.reply('§e没有需要继续上传的备份文件§r')
+        return
+    acquired = creating_backup.acquire(blocking=False)
+    if not acquired:
+        info_message(source, '§c正在备份中，请稍后再试§r')
+        return
+    try:
+        backend = config.create_storage_backend()
+        try:
+            success = 0
+            for backup_file in pending:
+                info_message(source, f'继续上传§e{os.path.basename(backup_file)}§r中...')
+                if upload_backup_file(source.get_server(), backend, backup_file, source.player if source.is_player else None):
+                    success += 1
+        finally:
+            backend.close()
+        info_message(source, f'续传完成：§a{success}§r/§6{len(pending)}§r 个文件上传成功')
+    except Exception as e:
+        info_message(source, f'§c续传失败：{str(e)}§r')
+        source.get_server().logger.exception('续传备份文件失败')
+    finally:
+        release_backup_lock()
 
 
 @new_thread('Zip-Backup')
 def create_backup(source: CommandSource, context: dict):
-    """创建备份"""
+    """
+    创建备份，context 中的 worlds 可以指定只备份部分世界
+    deferred 为 True 时备份被推迟的世界，拿到备份锁后才结束推迟，拿不到时推迟保持不变
+    """
     comment = context.get('cmt', None)
+    worlds = context.get('worlds', config.world_names)
+    deferred = context.get('deferred', False)
     global creating_backup
-    acquired = creating_backup.acquire(blocking=False)
     auto_save_on = True
-    if not acquired:
-        info_message(source, '§c正在备份中，请不要重复输入§r')
+    if not acquire_backup_lock(worlds, queue=context.get('auto', False)):
+        if deferred:
+            return  # 下次检查时再尝试
+        elif context.get('auto', False):
+            info_message(source, '当前正在备份中，本次自动备份将在其完成后开始', broadcast=True)
+        else:
+            info_message(source, '§c正在备份中，请不要重复输入§r')
         return
     try:
+        if deferred:
+            worlds = take_deferred_worlds(source.get_server())
+            if not worlds:
+                return  # 已经被其他线程开始了
         info_message(source, '备份中...请稍等', broadcast=True)
         start_time = time.time()
 
+        # 与同一主机上的其他实例排队
+        if not acquire_host_slot(source):
+            info_message(source, '§c插件卸载，备份中断！§r', broadcast=True)
+            return
+
+        # 统计世界大小，预测压缩包大小并检查磁盘空间
+        plan = get_archive_plan(worlds)
+        if config.preflight_enabled:
+            try:
+                checked_plan = preflight_check(source, plan)
+            except OSError as e:
+                # 检查本身出错时不影响备份
+                source.get_server().logger.warning(f'备份前检查失败：{str(e)}')
+                checked_plan = plan
+            if checked_plan is None:
+                info_message(source, '§c备份已取消§r', broadcast=True)
+                return
+            plan = checked_plan
+
         # save world
         if config.turn_off_auto_save:
             source.get_server().execute('save-off')
             auto_save_on = False
-        global game_saved
-        game_saved = False
+        game_saved.clear()
         source.get_server().execute('save-all flush')
-        while True:
-            time.sleep(0.01)
-            if game_saved:
-                break
-            if plugin_unloaded:
+        while not game_saved.wait(0.01):
+            if is_plugin_gone():
                 source.reply('§c插件卸载，备份中断！§r', broadcast=True)
                 if not auto_save_on:
                     source.get_server().execute('save-on')
@@ -291,21 +762,26 @@ def create_backup(source: CommandSource, context: dict):
                 return
 
         try:
-            # zipping worlds
-            timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
-            zip_file_name = os.path.join(config.backup_path, f'backup_{timestamp}.zip')
-            
             # 确保备份目录存在并有写入权限
             os.makedirs(config.backup_path, exist_ok=True)
             
-            info_message(source, f'创建压缩文件§e{os.path.basename(zip_file_name)}§r中...', broadcast=True)
-            zip_world(source.get_server(), comment)
+            # zipping worlds
+            zip_names = '§r, §e'.join(os.path.basename(task.zip_file) for task in plan)
+            info_message(source, f'创建压缩文件§e{zip_names}§r中...', broadcast=True)
+            player = source.player if source.is_player else None
+            zip_files, failed_worlds = zip_world(source.get_server(), comment, player=player, worlds=worlds, plan=plan)
+            release_host_slot()
             
-            # 如果启用了移动功能，移动备份文件
+            # 如果启用了移动功能，移动备份文件（部分世界失败时仍然移动成功的那些）
             if config.move_after_backup:
-                move_backup_file(source.get_server(), zip_file_name)
+                move_backup_file(source.get_server(), zip_files, player)
             
-            info_message(source, '备份§a完成§r，耗时{}秒'.format(round(time.time() - start_time, 1)), broadcast=True)
+            if len(failed_worlds) > 0:
+                info_message(source, '§c以下世界备份失败：{}§r，其余{}个压缩包已完成，耗时{}秒'.format(
+                    ', '.join(failed_worlds), len(zip_files), round(time.time() - start_time, 1)
+                ), broadcast=True)
+            else:
+                info_message(source, '备份§a完成§r，耗时{}秒'.format(round(time.time() - start_time, 1)), broadcast=True)
             
         except PermissionError as e:
             info_message(source, f'§c权限错误：无法写入备份文件，请检查目录权限: {str(e)}§r', broadcast=True)
@@ -315,10 +791,60 @@ def create_backup(source: CommandSource, context: dict):
             source.get_server().logger.exception('创建备份失败')
 
     finally:
+        release_host_slot()
         if not auto_save_on:
             source.get_server().execute('save-on')
+        release_backup_lock()
+
+
+def acquire_backup_lock(worlds: List[str], queue: bool = False) -> bool:
+    """获取备份锁，queue 为 True 时如果锁被占用则把这些世界加入队列，等当前备份结束后再备份"""
+    with backup_queue_lock:
+        if creating_backup.acquire(blocking=False):
+            return True
+        if queue:
+            queued_backup_worlds.extend(world for world in worlds if world not in queued_backup_worlds)
+        return False
+
+
+def release_backup_lock():
+    """释放备份锁，如果期间有自动备份到点排队，紧接着开始这些世界的备份"""
+    with backup_queue_lock:
         if creating_backup.locked():
             creating_backup.release()
+        worlds = [world for world in config.world_names if world in queued_backup_worlds]
+        queued_backup_worlds.clear()
+    if len(worlds) > 0 and not is_plugin_gone():
+        server_inst.logger.info('开始备份排队中的世界：{}'.format(', '.join(worlds)))
+        run_auto_backup(server_inst, worlds)
+    elif activity.deferred_since is not None and not is_plugin_gone():
+        # 推迟中的备份可能正因为备份锁被占用而没能开始
+        check_deferred_backup(server_inst)
+
+
+def acquire_host_slot(source: CommandSource) -> bool:
+    """获取主机级的备份名额，排队期间报告当前位置，插件卸载时放弃排队"""
+    global host_semaphore
+    if not config.host_lock_enabled:
+        return True
+    if not HostSemaphore.is_available():
+        source.get_server().logger.warning('当前系统不支持 flock，已跳过多实例备份协调')
+        return True
+    host_semaphore = HostSemaphore(config.host_lock_path, config.host_max_concurrent_backups, os.path.basename(os.getcwd()))
+    acquired = host_semaphore.acquire(
+        should_abort=is_plugin_gone,
+        on_wait=lambda position: info_message(source, f'同一主机上的其他实例正在备份，当前排在第§6{position}§r位', broadcast=True)
+    )
+    if not acquired:
+        host_semaphore = None
+    return acquired
+
+
+def release_host_slot():
+    global host_semaphore
+    if host_semaphore is not None:
+        host_semaphore.release()
+        host_semaphore = None
 
 
 def list_backup(source: CommandSource, context: dict, *, amount=10):
@@ -341,25 +867,105 @@ def list_backup(source: CommandSource, context: dict, *, amount=10):
         source.get_server().logger.exception('列出备份时发生错误')
 
 
-def get_backup_interval_in_seconds() -> int:
+def get_backup_interval_in_seconds(world: Optional[str] = None) -> int:
     """将自动备份间隔转换为秒"""
-    unit = config.auto_backup_unit.lower()
+    interval = config.get_world_setting(world, 'auto_backup_interval')
+    unit = config.get_world_setting(world, 'auto_backup_unit').lower()
     if unit == 'm':
-        return config.auto_backup_interval * 60
+        return interval * 60
     elif unit == 'h':
-        return config.auto_backup_interval * 3600
+        return interval * 3600
     elif unit == 'd':
-        return config.auto_backup_interval * 86400
+        return interval * 86400
     else:  # 默认为秒
-        return config.auto_backup_interval
+        return interval
+
+
+def get_schedule_key(world: Optional[str] = None) -> tuple:
+    """（某个世界）实际生效的定时配置，相同的世界可以共用一个定时任务"""
+    mode = config.get_world_setting(world, 'auto_backup_mode')
+    if mode == 'interval':
+        return mode, get_backup_interval_in_seconds(world)
+    return mode, config.get_world_setting(world, 'auto_backup_date_type')
+
+
+def auto_backup_task(server: PluginServerInterface, worlds: Optional[List[str]] = None):
+    """自动备份到点，开启智能调度时如果服务器繁忙则推迟备份"""
+    if worlds is None:
+        worlds = config.world_names
+    if config.smart_schedule_enabled and not is_server_quiet():
+        if not activity.defer(worlds):
+            return  # 上一次到点的备份还在推迟中
+        schedule_deferred_check(server)
+        server.logger.info('服务器当前较忙（在线{}人，最近{}秒内卡顿{}次），自动备份推迟到空闲时，最晚于{}开始'.format(
+            activity.online_count, config.smart_lag_window, activity.recent_lag_count(config.smart_lag_window),
+            time.strftime('%H:%M:%S', time.localtime(get_deferral_deadline(activity.deferred_since)))
+        ))
+        return
+    run_auto_backup(server, worlds)
 
 
-def auto_backup_task(server: PluginServerInterface):
-    """执行自动备份任务"""
+def schedule_deferred_check(server: PluginServerInterface):
+    scheduler.add_job(
+        check_deferred_backup,
+        'interval',
+        seconds=config.smart_check_interval,
+        id='auto_backup_deferred',
+        args=[server],
+        replace_existing=True
+    )
+
+
+def get_deferral_deadline(deferred_since: float) -> float:
+    """
+    被推迟的备份最晚的开始时间，默认为推迟满 smart_max_delay 秒时；
+    如果推迟期间会经过平时最空闲的时段，则提前到该时段开始时，不必等到最后在繁忙时被迫备份
+    """
+    deadline = deferred_since + config.smart_max_delay
+    quiet_hours = activity.quietest_hours()
+    if len(quiet_hours) == 0:
+        return deadline
+    t = time.localtime(deferred_since)
+    hour_start = time.mktime((t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour + 1, 0, 0, 0, 0, -1))
+    while hour_start < deadline:
+        if time.localtime(hour_start).tm_hour in quiet_hours:
+            return hour_start
+        hour_start += 3600
+    return deadline
+
+
+def check_deferred_backup(server: PluginServerInterface):
+    """检查被推迟的备份是否可以开始了：服务器空闲下来、到了最晚开始时间，或者智能调度已被关闭"""
+    deferred_since = activity.deferred_since
+    if deferred_since is None:
+        return
+    if config.smart_schedule_enabled and not is_server_quiet() and time.time() < get_deferral_deadline(deferred_since):
+        return
+    run_auto_backup(server, None)
+
+
+def take_deferred_worlds(server: PluginServerInterface) -> Optional[List[str]]:
+    """被推迟的备份拿到备份锁后调用：结束推迟并返回被推迟的世界，已经被其他线程开始时返回 None"""
+    deferred_since = activity.deferred_since
+    worlds = activity.finish_deferral()
+    if worlds is None:
+        return None
+    if scheduler and scheduler.get_job('auto_backup_deferred'):
+        scheduler.remove_job('auto_backup_deferred')
+    if deferred_since is not None:
+        server.logger.info('被推迟的自动备份开始执行，共推迟了{}秒'.format(round(time.time() - deferred_since)))
+    return [world for world in config.world_names if world in worlds]
+
+
+def run_auto_backup(server: PluginServerInterface, worlds: Optional[List[str]]):
+    """执行自动备份任务，worlds 为 None 时备份被推迟的世界"""
     try:
         source = server.get_plugin_command_source()
+        if worlds is None:
+            create_backup(source, {'deferred': True})
+            return
         info_message(source, '自动备份中……', broadcast=True)
-        create_backup(source, {})
+        create_backup(source, {'worlds': worlds, 'auto': True})
     except Exception as e:
         server.logger.error(f'自动备份失败: {str(e)}')
         server.logger.exception('自动备份详细错误信息：')
@@ -370,52 +976,67 @@ def auto_backup_task(server: PluginServerInterface):
             pass
 
 
+def is_server_quiet() -> bool:
+    return activity.is_quiet(config.smart_max_players, config.smart_lag_window, config.smart_max_lag_warnings)
+
+
 def start_auto_backup(server: PluginServerInterface):
-    """启动自动备份任务"""
+    """根据当前配置（重新）设置所有自动备份相关的定时任务"""
+    from apscheduler.schedulers.background import BackgroundScheduler
     global scheduler
     if scheduler is None:
         scheduler = BackgroundScheduler()
         scheduler.start()
 
     # 移除现有的定时任务（如果有）
-    if scheduler.get_job("auto_backup_task"):
-        scheduler.remove_job("auto_backup_task")
-
-    # 根据备份模式设置定时任务
-    if config.auto_backup_mode == 'interval':
-        # 计算间隔秒数
-        interval = config.auto_backup_interval
-        if config.auto_backup_unit == 'm':
-            interval *= 60
-        elif config.auto_backup_unit == 'h':
-            interval *= 3600
-        elif config.auto_backup_unit == 'd':
-            interval *= 86400
-        
-        # 添加间隔模式的定时任务
-        scheduler.add_job(
-            auto_backup_task,
-            'interval',
-            seconds=interval,
-            id="auto_backup_task",
-            args=[server_inst]
-        )
+    scheduler.remove_all_jobs()
+
+    # per_world 模式下定时配置与全局不同的世界使用单独的定时任务，定时配置相同的世界共用一个
+    shared_worlds = None
+    if config.archive_mode == 'per_world':
+        groups: Dict[tuple, List[str]] = {}
+        for world in config.world_names:
+            groups.setdefault(get_schedule_key(world), []).append(world)
+        shared_worlds = groups.pop(get_schedule_key(), [])
+        for worlds in groups.values():
+            scheduler.add_job(auto_backup_task, get_backup_trigger(worlds[0]), id='auto_backup_task:' + ','.join(worlds), args=[server, worlds])
+    if shared_worlds is None or len(shared_worlds) > 0:
+        scheduler.add_job(auto_backup_task, get_backup_trigger(), id='auto_backup_task', args=[server, shared_worlds])
+
+    # 智能调度需要定期统计各个时段的在线人数
+    if config.smart_schedule_enabled:
+        scheduler.add_job(activity.sample, 'interval', seconds=ACTIVITY_SAMPLE_INTERVAL, id='activity_sample')
+
+    # 已经到点、仍在推迟中的备份继续保留，智能调度被关闭时立即开始
+    if activity.deferred_since is not None:
+        schedule_deferred_check(server)
+        check_deferred_backup(server)
+
+
+def get_backup_trigger(world: Optional[str] = None):
+    """根据（某个世界的）备份模式创建定时任务的触发器"""
+    from apscheduler.triggers.interval import IntervalTrigger
+    if config.get_world_setting(world, 'auto_backup_mode') == 'interval':
+        return IntervalTrigger(seconds=get_backup_interval_in_seconds(world))
     else:  # date mode
-        # 根据类型设置cron表达式
-        if config.auto_backup_date_type == 'monthly':
-            cron = '0 1 1 * *'  # 每月1日凌晨1点
-        elif config.auto_backup_date_type == 'weekly':
-            cron = '0 1 * * 1'  # 每周一凌晨1点
-        else:  # daily
-            cron = '0 1 * * *'  # 每天凌晨1点
-        
-        # 添加日期模式的定时任务
-        scheduler.add_job(
-            auto_backup_task,
-            CronTrigger.from_crontab(cron),
-            id="auto_backup_task",
-            args=[server_inst]
-        )
+        return get_date_trigger(world)
+
+
+def get_date_trigger(world: Optional[str] = None) -> 'CronTrigger':
+    """日期模式的触发器，默认在凌晨1点，可以加上固定偏移和随机延迟来错开多个实例"""
+    from apscheduler.triggers.cron import CronTrigger
+    # 偏移跨过午夜时日期也要跟着顺延或提前，否则会变成在原定日期的另一个时间备份
+    days, seconds = config.get_date_schedule()
+    time_fields = dict(hour=seconds // 3600, minute=seconds // 60 % 60, second=seconds % 60)
+    jitter = config.auto_backup_date_jitter if config.auto_backup_date_jitter > 0 else None
+    date_type = config.get_world_setting(world, 'auto_backup_date_type')
+    if date_type == 'monthly':
+        # 每月1日，顺延时为2日，提前时为上个月的最后一天
+        return CronTrigger(day={-1: 'last', 0: 1, 1: 2}[days], jitter=jitter, **time_fields)
+    elif date_type == 'weekly':
+        return CronTrigger(day_of_week=days % 7, jitter=jitter, **time_fields)  # 每周一，0 为周一
+    else:  # daily
+        return CronTrigger(jitter=jitter, **time_fields)  # 每天
 
 
 def stop_auto_backup():
@@ -424,84 +1045,44 @@ def stop_auto_backup():
     if scheduler:
         scheduler.shutdown()
         scheduler = None
+    activity.finish_deferral()
+
+
+def refresh_online_players(server: PluginServerInterface):
+    """通过 RCON 获取当前在线玩家，插件在服务器运行中途加载时使用"""
+    if not server.is_rcon_running():
+        return
+    result = server.rcon_query('list')
+    if result is not None:
+        activity.parse_player_list(result)
 
 
 def on_info(server, info):
     if not info.is_user:
         if info.content == 'Saved the game':
-            global game_saved
-            game_saved = True
+            game_saved.set()
+        else:
+            activity.parse_lag_warning(info.content)
 
 
-def update_backup_interval():
-    global scheduler
-    if scheduler:
-        scheduler.remove_all_jobs()
-        
-        if config.auto_backup_enabled:
-            if config.auto_backup_mode == 'interval':
-                # 间隔模式
-                seconds = get_backup_interval_in_seconds()
-                scheduler.add_job(
-                    auto_backup_task,
-                    'interval',
-                    seconds=seconds,
-                    id='auto_backup_task',
-                    args=[server_inst]
-                )
-            else:
-                # 日期模式
-                if config.auto_backup_date_type == 'monthly':
-                    # 每月1号凌晨1点
-                    scheduler.add_job(
-                        auto_backup_task,
-                        'cron',
-                        day='1',
-                        hour='1',
-                        minute='0',
-                        id='auto_backup_task',
-                        args=[server_inst]
-                    )
-                elif config.auto_backup_date_type == 'weekly':
-                    # 每周一凌晨1点
-                    scheduler.add_job(
-                        auto_backup_task,
-                        'cron',
-                        day_of_week='mon',
-                        hour='1',
-                        minute='0',
-                        id='auto_backup_task',
-                        args=[server_inst]
-                    )
-                else:  # daily
-                    # 每天凌晨1点
-                    scheduler.add_job(
-                        auto_backup_task,
-                        'cron',
-                        hour='1',
-                        minute='0',
-                        id='auto_backup_task',
-                        args=[server_inst]
-                    )
+def on_player_joined(server: PluginServerInterface, player: str, info):
+    activity.player_joined(player)
 
 
-def set_backup_date(source: CommandSource, context: dict):
-    """设置按日期备份"""
-    date_type = context.get('type', '').lower()
-    if date_type not in ['monthly', 'weekly', 'daily']:
-        source.reply('§c日期类型必须是monthly/weekly/daily中的一个§r')
-        return
+def on_player_left(server: PluginServerInterface, player: str):
+    activity.player_left(player)
+    # 有人离开时服务器可能已经空闲下来了，不必等到下一次检查
+    if activity.deferred_since is not None:
+        check_deferred_backup(server)
 
-    config.auto_backup_date_type = date_type
-    config.auto_backup_mode = 'date'  # 自动切换到日期模式
-    config.save()
 
-    # 更新定时任务
-    update_backup_interval()
+def on_server_startup(server: PluginServerInterface):
+    activity.set_players([])
+    refresh_online_players(server)
 
-    # 显示成功消息
-    type_names = {'monthly': '每月', 'weekly': '每周', 'daily': '每天'}
-    source.reply(f'§a已将备份时间设置为{type_names[date_type]}凌晨1点§r')
+
+def on_server_stop(server: PluginServerInterface, return_code: int):
+    activity.set_players([])
 
 
 def change_backup_mode(source: CommandSource, context: dict):
@@ -585,11 +1166,44 @@ def set_backup_date(source: CommandSource, context: dict):
 
     # 显示友好的类型名称
     type_names = {'monthly': '每月', 'weekly': '每周', 'daily': '每天'}
-    source.reply(f'§a已设置为{type_names[backup_type]}凌晨1点自动备份§r')
+    source.reply(f'§a已设置为{type_names[backup_type]}{config.get_date_time_text()}自动备份§r')
     # 显示当前配置
     show_backup_stats(source)
 
 
+def set_smart_schedule(source: CommandSource, enabled: bool):
+    """开启或关闭智能调度"""
+    config.smart_schedule_enabled = enabled
+    config.save()
+
+    # 如果自动备份已启用，重新设置定时任务
+    if config.auto_backup_enabled:
+        start_auto_backup(server_inst)
+
+    if enabled:
+        source.reply(f'§a已启用智能调度，在线人数超过{config.smart_max_players}人或服务器卡顿时最多推迟{config.smart_max_delay}秒备份§r')
+    else:
+        source.reply('§c已关闭智能调度§r')
+
+
+def set_archive_mode(source: CommandSource, context: dict):
+    """设置归档模式"""
+    mode = context['mode']
+    if mode not in ['single', 'per_world']:
+        source.reply('§c无效的归档模式，可选值：single(所有世界一个压缩包), per_world(每个世界单独打包)§r')
+        return
+
+    config.archive_mode = mode
+    config.save()
+
+    # 单个世界的定时配置只在 per_world 模式下生效，需要重新设置定时任务
+    if config.auto_backup_enabled:
+        start_auto_backup(server_inst)
+
+    mode_names = {'single': '所有世界一个压缩包', 'per_world': '每个世界单独打包'}
+    source.reply(f'§a已将归档模式设置为{mode_names[mode]}§r')
+
+
 def set_compression_level(source: CommandSource, context: dict):
     """设置压缩等级"""
     level = context['level']
@@ -624,19 +1238,89 @@ def show_backup_stats(source: CommandSource):
         status_lines.append(f'备份间隔: §6{config.auto_backup_interval}{config.auto_backup_unit}§r')
     else:
         type_names = {'monthly': '每月', 'weekly': '每周', 'daily': '每天'}
-        status_lines.append(f'备份类型: §6{type_names[config.auto_backup_date_type]}凌晨1点§r')
+        status_lines.append(f'备份类型: §6{type_names[config.auto_backup_date_type]}{config.get_date_time_text()}§r')
     
     if config.auto_backup_enabled and next_backup_time:
         status_lines.append(f'下次备份时间: §e{next_backup_time}§r')
 
+    # 添加智能调度信息
+    status_lines.append(f'智能调度: {"§a已开启§r" if config.smart_schedule_enabled else "§c已关闭§r"}')
+    if config.smart_schedule_enabled:
+        status_lines.append('服务器状态: 在线§6{}§r人，最近{}秒内卡顿§6{}§r次，当前{}'.format(
+            activity.online_count, config.smart_lag_window, activity.recent_lag_count(config.smart_lag_window),
+            '§a空闲§r' if is_server_quiet() else '§c繁忙§r'
+        ))
+        deferred_since = activity.deferred_since
+        if deferred_since is not None:
+            status_lines.append('自动备份已推迟§e{}§r秒，最晚于§e{}§r开始'.format(
+                round(time.time() - deferred_since), time.strftime('%H:%M:%S', time.localtime(get_deferral_deadline(deferred_since)))
+            ))
+        quiet_hours = activity.quietest_hours()
+        if len(quiet_hours) > 0:
+            status_lines.append('平时最空闲的时段: §e{}§r'.format(', '.join(f'{hour:02d}:00' for hour in quiet_hours)))
+
+    # 添加多实例协调信息
+    if config.host_lock_enabled:
+        if host_semaphore is not None and host_semaphore.position is not None:
+            status_lines.append(f'主机备份队列: 排在第§6{host_semaphore.position}§r位')
+        elif HostSemaphore.is_available():
+            semaphore = HostSemaphore(config.host_lock_path, config.host_max_concurrent_backups)
+            status_lines.append(f'主机备份队列: §6{semaphore.waiting_count()}§r个实例等待中，名额上限§6{config.host_max_concurrent_backups}§r')
+
+    # 添加进度信息，重载前开始的备份结束时只会更新旧实例的 last_progress，这里从进度对象本身判断是否已完成
+    progress, finished = current_progress, last_progress
+    if progress is not None and progress.finished:
+        progress, finished = None, progress.snapshot
+    if progress is not None:
+        snapshot = progress.snapshot
+        status_lines.append('当前进度: ' + (snapshot.format() if snapshot is not None else f'{progress.tracker.title} 进行中'))
+    elif finished is not None:
+        status_lines.append('上次{}: 用时§e{}秒§r，平均§e{:.1f}MB/s§r'.format(
+            finished.title, round(finished.elapsed, 1), finished.speed / 2 ** 20
+        ))
+    # 添加预测和实际结果
+    if last_forecast is not None:
+        status_lines.append('上次备份预测: 约§e{}MB§r，约§e{}秒§r{}'.format(
+            round(last_forecast.output_bytes / 2 ** 20, 1), round(last_forecast.duration, 1),
+            '' if last_forecast.samples > 0 else '（无历史记录，使用默认值）'
+        ))
+    if last_result is not None:
+        ratio = last_result.output_bytes / last_result.input_bytes if last_result.input_bytes > 0 else 1
+        status_lines.append('上次备份实际: §e{}MB§r（压缩率{}%），§e{}秒§r'.format(
+            round(last_result.output_bytes / 2 ** 20, 1), round(ratio * 100, 1), round(last_result.duration, 1)
+        ))
+    if load_duration is not None:
+        status_lines.append(f'插件加载耗时: §e{round(load_duration * 1000, 1)}ms§r')
+
     # 添加压缩等级信息
     level_names = {'speed': '最快速度', 'best': '最佳压缩比(LZMA)'}
     status_lines.append(f'压缩等级: §6{level_names.get(config.compression_level, "未知")}§r')
 
+    # 添加归档模式信息
+    if config.archive_mode == 'per_world':
+        status_lines.append(f'归档模式: §6每个世界单独打包§r，同一磁盘最多同时压缩§6{config.max_parallel_per_disk}§r个世界')
+        for world in config.world_names:
+            world_line = f'  §e{world}§r: {level_names.get(config.get_world_setting(world, "compression_level"), "未知")}'
+            job = get_world_job(world)
+            if config.auto_backup_enabled and job is not None and job.next_run_time is not None:
+                world_line += f'，下次备份 §e{job.next_run_time.strftime("%Y-%m-%d %H:%M:%S")}§r'
+            status_lines.append(world_line)
+    else:
+        status_lines.append('归档模式: §6所有世界一个压缩包§r')
+
     # 添加移动功能状态信息
     status_lines.append(f'备份后移动: {"§a已开启§r" if config.move_after_backup else "§c已关闭§r"}')
     if config.move_after_backup:
-        status_lines.append(f'移动目标路径: §e{config.move_to_path}§r')
+        status_lines.append(f'移动目标类型: §6{config.move_backend}§r')
+        if config.move_backend == 'sftp':
+            status_lines.append(f'移动目标路径: §esftp://{config.sftp_options.get("host", "")}{config.sftp_options.get("path", "")}§r')
+        elif config.move_backend == 's3':
+            status_lines.append(f'移动目标路径: §es3://{config.s3_options.get("bucket", "")}/{config.s3_options.get("prefix", "")}§r')
+        else:
+            status_lines.append(f'移动目标路径: §e{config.move_to_path}§r')
+        pending = get_pending_uploads()
+        if len(pending) > 0:
+            status_lines.append(f'等待续传: §c{len(pending)}§r个文件')
         status_lines.append(f'移动后删除原文件: {"§a是§r" if config.delete_after_move else "§c否§r"}')
     
     # 输出信息
@@ -644,15 +1328,85 @@ def show_backup_stats(source: CommandSource):
         source.reply(line)
 
 
+def get_world_job(world: str):
+    """负责备份某个世界的定时任务"""
+    if scheduler is None:
+        return None
+    for job in scheduler.get_jobs():
+        if job.id.startswith('auto_backup_task') and (job.args[1] is None or world in job.args[1]):
+            return job
+    return None
+
+
+def adopt_runtime_state(old) -> bool:
+    """
+    重载时接管旧实例的运行状态：备份锁、存档完成事件、定时器及其任务、进度和统计数据
+    旧实例中仍在进行的备份会继续使用这些共享对象完成，返回是否接管了定时器
+    """
+    global creating_backup, game_saved, scheduler, activity, current_progress, last_progress, host_semaphore
+    global backup_history, last_forecast, last_result, backup_queue_lock, queued_backup_worlds
+    if old is None:
+        return False
+    if hasattr(old, 'backup_queue_lock') and hasattr(old, 'queued_backup_worlds'):
+        backup_queue_lock, queued_backup_worlds = old.backup_queue_lock, old.queued_backup_worlds
+    if hasattr(old, 'creating_backup') and type(old.creating_backup) == type(creating_backup):
+        creating_backup = old.creating_backup
+    if isinstance(getattr(old, 'game_saved', None), type(game_saved)):
+        game_saved = old.game_saved
+    if hasattr(old, 'activity'):
+        activity = old.activity
+    current_progress = getattr(old, 'current_progress', None)
+    last_progress = getattr(old, 'last_progress', None)
+    host_semaphore = getattr(old, 'host_semaphore', None)
+    backup_history = getattr(old, 'backup_history', None)
+    last_forecast = getattr(old, 'last_forecast', None)
+    last_result = getattr(old, 'last_result', None)
+
+    # 告诉旧实例它已经被接管，进行中的备份不要中断，定时器也不要关闭
+    old.plugin_unloaded = False
+    if getattr(old, 'scheduler', None) is not None and old.scheduler.running:
+        scheduler = old.scheduler
+        old.scheduler = None
+        return True
+    return False
+
+
+def get_schedule_signature(cfg) -> tuple:
+    """影响定时任务的配置项，重载前后一致时可以直接沿用原来的任务和下次执行时间"""
+    return tuple(getattr(cfg, key, None) for key in (
+        'auto_backup_enabled', 'auto_backup_mode', 'auto_backup_interval', 'auto_backup_unit',
+        'auto_backup_date_type', 'auto_backup_date_offset', 'auto_backup_date_jitter',
+        'smart_schedule_enabled', 'smart_check_interval', 'archive_mode', 'world_names', 'world_overrides'
+    ))
+
+
+def rebind_scheduler_jobs(server: PluginServerInterface):
+    """让接管过来的定时任务改为调用新实例的函数，保留原来的下次执行时间"""
+    functions = {
+        'auto_backup_task': (auto_backup_task, [server]),
+        'auto_backup_deferred': (check_deferred_backup, [server]),
+        'activity_sample': (activity.sample, []),
+    }
+    for job in scheduler.get_jobs():
+        job_type = job.id.split(':', 1)[0]  # 单独定时的世界的任务 id 为 auto_backup_task:<世界名,...>
+        if job_type in functions:
+            func, args = functions[job_type]
+            job.modify(func=func, args=args + list(job.args[len(args):]))
+        else:
+            job.remove()
+
+
 def on_load(server: PluginServerInterface, old):
     """插件加载时调用的函数"""
-    global creating_backup, config, server_inst
+    global config, server_inst, load_duration
     server_inst = server
-    if hasattr(old, 'creating_backup') and type(old.creating_backup) == type(creating_backup):
-        creating_backup = old.creating_backup
+    scheduler_adopted = adopt_runtime_state(old)
     server.register_help_message(Prefix, '永久备份Reforged')
     config = server.load_config_simple(CONFIG_FILE, target_class=Configure, in_data_folder=False)
     register_command(server)
+    refresh_online_players(server)
+    if not config.is_date_offset_valid():
+        server.logger.warning('auto_backup_date_offset 只能在 -86399 ~ 86399 秒之间，已忽略该配置')
 
     # 显示加载字符画
     server.logger.info(PLUGIN_LOADED_ART)
@@ -674,18 +1428,42 @@ def on_load(server: PluginServerInterface, old):
         # 如果有任何配置被初始化，保存配置
         if config_changed:
             config.save()
-            
-        start_auto_backup(server)
+
+        # 重载且定时配置没有变化时沿用原来的任务，否则重新设置
+        if scheduler_adopted and get_schedule_signature(old.config) == get_schedule_signature(config):
+            rebind_scheduler_jobs(server)
+        else:
+            start_auto_backup(server)
+    elif scheduler is not None:
+        stop_auto_backup()
+
+    load_duration = time.time() - PLUGIN_IMPORT_TIME
+    server.logger.info('插件加载完成，耗时{}ms{}'.format(round(load_duration * 1000, 1), '（已接管原有的定时任务）' if scheduler_adopted else ''))
 
 
 def on_unload(server: PluginServerInterface):
-    global plugin_unloaded
+    global plugin_unloaded, unload_time
     plugin_unloaded = True
-    # 停止自动备份
-    stop_auto_backup()
+    unload_time = time.time()
+    # 重载时新实例会在 on_load 中接管定时器，一段时间后仍未被接管才停止自动备份
+    timer = threading.Timer(RELOAD_GRACE_PERIOD, stop_abandoned_auto_backup)
+    timer.daemon = True
+    timer.start()
+
+
+def stop_abandoned_auto_backup():
+    if plugin_unloaded:
+        stop_auto_backup()
+
+
+def is_plugin_gone() -> bool:
+    """插件已被卸载且没有新实例接管，进行中的操作应该中断"""
+    return plugin_unloaded and time.time() - unload_time > RELOAD_GRACE_PERIOD
 
 
 def on_mcdr_stop(server: PluginServerInterface):
+    with backup_queue_lock:
+        queued_backup_worlds.clear()
     if creating_backup.locked():
         server.logger.info('Waiting for up to 300s for permanent backup to complete')
         if creating_backup.acquire(timeout=300):
@@ -757,6 +1535,17 @@ def register_command(server: PluginServerInterface):
                     Text('mode').
                     runs(lambda src, ctx: change_backup_mode(src, ctx))
                 )
+            ).
+            then(
+                get_literal_node('smart').
+                then(
+                    get_literal_node('enable').
+                    runs(lambda src: set_smart_schedule(src, True))
+                ).
+                then(
+                    get_literal_node('disable').
+                    runs(lambda src: set_smart_schedule(src, False))
+                )
             )
         ).
         then(
@@ -766,6 +1555,13 @@ def register_command(server: PluginServerInterface):
                 runs(lambda src, ctx: set_compression_level(src, ctx))
             )
         ).
+        then(
+            get_literal_node('archive').
+            then(
+                Text('mode').
+                runs(lambda src, ctx: set_archive_mode(src, ctx))
+            )
+        ).
         then(
             Literal('move').
             then(
@@ -783,6 +1579,17 @@ def register_command(server: PluginServerInterface):
                     runs(lambda src, ctx: set_move_path(src, ctx))
                 )
             ).
+            then(
+                get_literal_node('backend').
+                then(
+                    Text('backend').
+                    runs(lambda src, ctx: set_move_backend(src, ctx))
+                )
+            ).
+            then(
+                get_literal_node('retry').
+                runs(lambda src: retry_pending_uploads(src))
+            ).
             then(
                 get_literal_node('delete').
                 then(
@@ -827,6 +1634,18 @@ def set_move_path(source: CommandSource, context: dict):
     show_backup_stats(source)
 
 
+def set_move_backend(source: CommandSource, context: dict):
+    """设置备份移动目标类型"""
+    backend = context['backend']
+    if backend not in BACKENDS:
+        source.reply('§c无效的目标类型，可选值：local(本地/NFS), sftp, s3§r')
+        return
+    config.move_backend = backend
+    config.save()
+    source.reply(f'§a已设置备份移动目标类型为：{backend}§r')
+    show_backup_stats(source)
+
+
 def enable_delete_after_move(source: CommandSource):
     """启用移动后删除原文件"""
     config.delete_after_move = True
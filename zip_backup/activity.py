@@ -0,0 +1,97 @@
+import collections
+import re
+import threading
+import time
+from typing import Deque, Iterable, List, Optional, Set, Tuple
+
+'''
+服务器繁忙程度统计，供智能调度判断什么时候适合备份
+
+在线人数来自玩家加入/离开事件，卡顿来自服务端的 "Can't keep up!" 警告；
+另外按一天中的小时统计平均在线人数，用来找出平时最空闲的时段
+'''
+
+LAG_WARNING_PATTERN = re.compile(r"Can't keep up!.*?Running (\d+)ms")
+PLAYER_LIST_PATTERN = re.compile(r'There are (\d+) of a max(?: of)? \d+ players online:(.*)')
+
+
+class ActivityTracker:
+    HOURLY_SMOOTHING = 0.2
+
+    def __init__(self):
+        self.players: Set[str] = set()
+        self.lag_events: Deque[Tuple[float, int]] = collections.deque(maxlen=256)  # (时间, 落后的毫秒数)
+        self.hourly_players: List[Optional[float]] = [None] * 24  # 每个小时的平均在线人数
+        self.deferred_since: Optional[float] = None  # 被推迟的备份原本应该开始的时间
+        self.deferred_worlds: Set[str] = set()  # 被推迟备份的世界
+        self.__lock = threading.Lock()
+
+    @property
+    def online_count(self) -> int:
+        return len(self.players)
+
+    def player_joined(self, player: str):
+        with self.__lock:
+            self.players.add(player)
+
+    def player_left(self, player: str):
+        with self.__lock:
+            self.players.discard(player)
+
+    def set_players(self, players: Iterable[str]):
+        with self.__lock:
+            self.players = set(players)
+
+    def parse_player_list(self, text: str) -> bool:
+        """解析 list 指令的输出，成功时更新在线玩家"""
+        match = PLAYER_LIST_PATTERN.search(text)
+        if match is None:
+            return False
+        self.set_players(name.strip() for name in match.group(2).split(',') if name.strip())
+        return True
+
+    def parse_lag_warning(self, text: str) -> bool:
+        match = LAG_WARNING_PATTERN.search(text)
+        if match is None:
+            return False
+        self.lag_events.append((time.time(), int(match.group(1))))
+        return True
+
+    def recent_lag_count(self, window: float) -> int:
+        since = time.time() - window
+        return sum(1 for t, _ in list(self.lag_events) if t >= since)
+
+    def defer(self, worlds: Iterable[str]) -> bool:
+        """推迟这些世界的备份，已经在推迟中时合并进去并返回 False"""
+        with self.__lock:
+            self.deferred_worlds.update(worlds)
+            if self.deferred_since is not None:
+                return False
+            self.deferred_since = time.time()
+            return True
+
+    def finish_deferral(self) -> Optional[List[str]]:
+        """结束推迟并返回被推迟的世界，只有一个线程能拿到结果并负责开始备份"""
+        with self.__lock:
+            if self.deferred_since is None:
+                return None
+            worlds = sorted(self.deferred_worlds)
+            self.deferred_since = None
+            self.deferred_worlds = set()
+            return worlds
+
+    def sample(self):
+        """记录当前小时的在线人数，需要定期调用"""
+        hour = time.localtime().tm_hour
+        count = self.online_count
+        average = self.hourly_players[hour]
+        self.hourly_players[hour] = count if average is None else average + (count - average) * self.HOURLY_SMOOTHING
+
+    def quietest_hours(self, amount: int = 3) -> List[int]:
+        """平均在线人数最少的几个小时，还没有统计数据时返回空列表"""
+        hours = [hour for hour in range(24) if self.hourly_players[hour] is not None]
+        hours.sort(key=lambda hour: (self.hourly_players[hour], hour))
+        return hours[:amount]
+
+    def is_quiet(self, max_players: int, lag_window: float, max_lag_warnings: int) -> bool:
+        return self.online_count <= max_players and self.recent_lag_count(lag_window) <= max_lag_warnings
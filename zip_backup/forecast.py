@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import time
+from typing import List, NamedTuple
+
+'''
+根据历史备份记录预测压缩包大小和耗时
+
+每生成一个压缩包记录一次：世界、压缩等级、原始大小、压缩后大小、耗时。
+预测时优先参考同一组世界、同一压缩等级的最近记录，没有时参考同一压缩等级的所有记录，
+仍然没有时使用保守的默认值
+'''
+
+MAX_RECORDS = 100
+RECENT_RECORDS = 10  # 预测时参考的最近记录数量
+DEFAULT_RATIOS = {'speed': 1.0, 'best': 0.7}  # 压缩后大小 / 原始大小
+DEFAULT_THROUGHPUTS = {'speed': 100 * 2 ** 20, 'best': 5 * 2 ** 20}  # 字节/秒
+
+
+class Forecast(NamedTuple):
+    input_bytes: int
+    output_bytes: int
+    duration: float
+    samples: int  # 参考的历史记录数量，0 表示使用的是默认值
+
+    def __add__(self, other: 'Forecast') -> 'Forecast':
+        return Forecast(
+            self.input_bytes + other.input_bytes, self.output_bytes + other.output_bytes,
+            self.duration + other.duration, self.samples + other.samples
+        )
+
+
+class BackupHistory:
+    def __init__(self, path: str):
+        self.path = path
+        self.records: List[dict] = []
+        self.__lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.records = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def record(self, key: str, level: str, input_bytes: int, output_bytes: int, duration: float):
+        with self.__lock:
+            self.records.append({
+                'time': time.time(),
+                'key': key,
+                'level': level,
+                'input_bytes': input_bytes,
+                'output_bytes': output_bytes,
+                'duration': duration
+            })
+            del self.records[:-MAX_RECORDS]
+            # 分世界压缩时多个线程会同时记录，写文件也要在锁内进行，否则会争抢同一个临时文件
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.records, f, ensure_ascii=False)
+            os.replace(temp_file, self.path)
+
+    def estimate(self, key: str, level: str, input_bytes: int) -> Forecast:
+        """预测压缩 input_bytes 字节的数据会得到多大的压缩包、需要多长时间"""
+        with self.__lock:
+            records = [r for r in self.records if r['level'] == level and r['input_bytes'] > 0]
+        matched = [r for r in records if r['key'] == key] or records
+        matched = matched[-RECENT_RECORDS:]
+        if len(matched) == 0:
+            ratio = DEFAULT_RATIOS.get(level, 1.0)
+            throughput = DEFAULT_THROUGHPUTS.get(level, DEFAULT_THROUGHPUTS['best'])
+        else:
+            total_input = sum(r['input_bytes'] for r in matched)
+            total_duration = sum(r['duration'] for r in matched)
+            ratio = sum(r['output_bytes'] for r in matched) / total_input
+            throughput = total_input / total_duration if total_duration > 0 else DEFAULT_THROUGHPUTS['speed']
+        return Forecast(input_bytes, int(input_bytes * ratio), input_bytes / throughput, len(matched))
@@ -0,0 +1,142 @@
+import os
+import time
+from typing import Callable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 flock，多实例协调不可用
+    fcntl = None
+
+'''
+同一主机上多个 MCDR 实例之间的备份协调
+
+锁目录结构：
+lock_path/
+    slot-0.lock       每个文件代表一个备份名额，持有其 flock 即占用该名额
+    slot-1.lock
+    queue/
+        <时间戳>-<pid>-<名称>.ticket   等待中的实例，持有自己票据的 flock 表示仍然存活
+
+实例按票据的时间戳排队，只有排在最前面的实例才会尝试获取名额；
+进程意外退出时 flock 会被系统自动释放，其他实例发现无人持有的票据会将其清理掉
+'''
+
+
+class HostSemaphore:
+    """基于 flock 的跨进程信号量，按先来后到的顺序分配名额"""
+
+    def __init__(self, lock_path: str, slots: int, name: str = ''):
+        self.lock_path = lock_path
+        self.slots = max(1, slots)
+        self.name = ''.join(c for c in name if c.isalnum() or c in '-_') or 'mcdr'
+        self.position: Optional[int] = None  # 排队时的位置，从 1 开始
+        self.__slot_fd: Optional[int] = None
+        self.__ticket_fd: Optional[int] = None
+        self.__ticket_name: Optional[str] = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return fcntl is not None
+
+    @property
+    def held(self) -> bool:
+        return self.__slot_fd is not None
+
+    def __queue_path(self) -> str:
+        return os.path.join(self.lock_path, 'queue')
+
+    def __enqueue(self):
+        os.makedirs(self.__queue_path(), exist_ok=True)
+        name = '{:020d}-{}-{}.ticket'.format(time.time_ns(), os.getpid(), self.name)
+        # 先在队列外创建并加锁，再重命名进队列，避免别的实例把刚创建还没加锁的票据当成失效票据删掉
+        temp_file = os.path.join(self.lock_path, name + '.tmp')
+        fd = os.open(temp_file, os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.replace(temp_file, os.path.join(self.__queue_path(), name))
+        self.__ticket_fd, self.__ticket_name = fd, name
+
+    def __dequeue(self):
+        if self.__ticket_fd is None:
+            return
+        try:
+            os.remove(os.path.join(self.__queue_path(), self.__ticket_name))
+        except FileNotFoundError:
+            pass
+        os.close(self.__ticket_fd)
+        self.__ticket_fd = self.__ticket_name = None
+
+    def __live_tickets(self) -> List[str]:
+        result = []
+        for name in sorted(os.listdir(self.__queue_path())):
+            if not name.endswith('.ticket'):
+                continue
+            if name == self.__ticket_name:
+                result.append(name)
+                continue
+            path = os.path.join(self.__queue_path(), name)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                result.append(name)  # 拿不到锁，说明持有者仍在等待
+            else:
+                try:
+                    os.remove(path)  # 持有者已经退出
+                except FileNotFoundError:
+                    pass
+            finally:
+                os.close(fd)
+        return result
+
+    def __try_take_slot(self) -> bool:
+        for i in range(self.slots):
+            fd = os.open(os.path.join(self.lock_path, f'slot-{i}.lock'), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            self.__slot_fd = fd
+            return True
+        return False
+
+    def acquire(self, should_abort: Callable[[], bool], on_wait: Callable[[int], None], poll_interval: float = 1.0) -> bool:
+        """
+        排队获取一个名额，位置变化时调用 on_wait(位置)
+        should_abort 返回 True 时放弃排队并返回 False
+        """
+        if fcntl is None or self.held:
+            return True
+        os.makedirs(self.lock_path, exist_ok=True)
+        self.__enqueue()
+        try:
+            while True:
+                tickets = self.__live_tickets()
+                position = tickets.index(self.__ticket_name) if self.__ticket_name in tickets else 0
+                if position == 0 and self.__try_take_slot():
+                    self.position = None
+                    return True
+                if position + 1 != self.position:
+                    self.position = position + 1
+                    on_wait(self.position)
+                if should_abort():
+                    self.position = None
+                    return False
+                time.sleep(poll_interval)
+        finally:
+            self.__dequeue()
+
+    def release(self):
+        if self.__slot_fd is not None:
+            fcntl.flock(self.__slot_fd, fcntl.LOCK_UN)
+            os.close(self.__slot_fd)
+            self.__slot_fd = None
+
+    def waiting_count(self) -> int:
+        """当前正在排队等待的实例数量"""
+        if fcntl is None or not os.path.isdir(self.__queue_path()):
+            return 0
+        return len(self.__live_tickets())
@@ -0,0 +1,149 @@
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+'''
+低开销的进度统计
+
+工作线程只在自己的计数槽里累加字节数，不加锁也不刷新任何输出；
+由一个独立的报告线程按固定频率汇总所有计数槽，计算百分比、速度和剩余时间后交给各个输出端
+'''
+
+
+class ProgressSnapshot(NamedTuple):
+    title: str
+    done: int
+    total: int
+    elapsed: float
+    speed: float  # 字节/秒
+    finished: bool
+
+    @property
+    def percent(self) -> float:
+        if self.total <= 0:
+            return 100.0 if self.finished else 0.0
+        return min(100.0, self.done * 100.0 / self.total)
+
+    @property
+    def eta(self) -> Optional[float]:
+        if self.finished:
+            return 0.0
+        if self.speed <= 0:
+            return None
+        return max(0.0, (self.total - self.done) / self.speed)
+
+    def format(self) -> str:
+        eta = self.eta
+        eta_text = '--:--:--' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))
+        return '{} §6{:.1f}%§r | §e{:.1f}MB/s§r | 剩余 §e{}§r'.format(
+            self.title, self.percent, self.speed / 2 ** 20, eta_text
+        )
+
+
+class _Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+class ProgressTracker:
+    """字节计数器，每个线程写入自己的计数槽，add 本身不加锁"""
+
+    def __init__(self, title: str, total: int):
+        self.title = title
+        self.total = total
+        self.start_time = time.time()
+        self.__counters: List[_Counter] = []
+        self.__counters_lock = threading.Lock()
+        self.__local = threading.local()
+
+    def add(self, amount: int):
+        counter = getattr(self.__local, 'counter', None)
+        if counter is None:
+            counter = _Counter()
+            with self.__counters_lock:
+                self.__counters.append(counter)
+            self.__local.counter = counter
+        counter.value += amount
+
+    @property
+    def done(self) -> int:
+        with self.__counters_lock:
+            counters = list(self.__counters)
+        return sum(counter.value for counter in counters)
+
+
+ProgressSink = Callable[[ProgressSnapshot], None]
+
+
+class ProgressReporter:
+    """按固定频率采样 ProgressTracker 并把结果发送给所有输出端"""
+    SPEED_SMOOTHING = 0.3
+
+    def __init__(self, tracker: ProgressTracker, interval: float, sinks: List[ProgressSink]):
+        self.tracker = tracker
+        self.interval = max(0.1, interval)
+        self.sinks = sinks
+        self.snapshot: Optional[ProgressSnapshot] = None
+        self.__speed = 0.0
+        self.__last_done = 0
+        self.__last_time = tracker.start_time
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='ZipBackup-Progress', daemon=True)
+
+    def start(self) -> 'ProgressReporter':
+        self.__thread.start()
+        return self
+
+    @property
+    def finished(self) -> bool:
+        return self.__stop_event.is_set()
+
+    def stop(self):
+        """停止报告线程，并发送一次最终结果"""
+        self.__stop_event.set()
+        self.__thread.join()
+        self.__report(finished=True)
+
+    def sample(self, finished: bool = False) -> ProgressSnapshot:
+        now = time.time()
+        done = self.tracker.done
+        if finished:
+            elapsed = now - self.tracker.start_time
+            speed = done / elapsed if elapsed > 0 else 0.0
+        else:
+            delta = now - self.__last_time
+            if delta > 0:
+                current_speed = (done - self.__last_done) / delta
+                if self.__speed == 0:
+                    self.__speed = current_speed
+                else:
+                    self.__speed += (current_speed - self.__speed) * self.SPEED_SMOOTHING
+            self.__last_done, self.__last_time = done, now
+            speed = self.__speed
+        return ProgressSnapshot(self.tracker.title, done, self.tracker.total, now - self.tracker.start_time, speed, finished)
+
+    def __report(self, finished: bool = False):
+        self.snapshot = self.sample(finished)
+        for sink in self.sinks:
+            try:
+                sink(self.snapshot)
+            except Exception:
+                pass  # 输出失败不能影响备份本身
+
+    def __run(self):
+        while not self.__stop_event.wait(self.interval):
+            self.__report()
+
+
+def step_filter(sink: ProgressSink, step: float) -> ProgressSink:
+    """只在进度跨过 step 百分比的整数倍时才转发，用于聊天栏之类不适合频繁刷新的输出"""
+    last_step = [-1]
+
+    def filtered(snapshot: ProgressSnapshot):
+        current = int(snapshot.percent // step)
+        if current != last_step[0] or snapshot.finished:
+            last_step[0] = current
+            sink(snapshot)
+    return filtered
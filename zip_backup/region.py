@@ -0,0 +1,270 @@
+import hashlib
+import mmap
+import os
+import struct
+import time
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+'''
+基于内存映射的区域文件（.mca/.mcc）读取
+
+整个文件通过 mmap 映射进内存，文件头和每个区块都以 memoryview 切片的形式提供，
+读取过程中不会为每个区块分配新的 bytes 对象，切片可以直接交给 hashlib 或压缩器
+
+区域文件格式：
+    0x0000 - 0x0FFF  1024 个区块位置，每个 4 字节：高 3 字节为起始扇区，低 1 字节为扇区数量
+    0x1000 - 0x1FFF  1024 个区块的最后修改时间戳，每个 4 字节
+    之后按 4KB 扇区存放区块：4 字节长度 + 1 字节压缩类型 + 压缩后的数据
+    压缩类型的最高位为 1 时，区块数据存放在同目录下的 c.<x>.<z>.mcc 文件中
+
+注意：映射期间文件不能被截断，因此只应在服务端停止写入（save-off）时使用；
+在关闭 RegionFile 之前需要先释放所有从它得到的切片
+
+本文件不依赖 MCDR，可以直接运行做性能对比：python region.py <世界文件夹>
+'''
+
+SECTOR_SIZE = 4096
+HEADER_SIZE = SECTOR_SIZE * 2
+CHUNKS_PER_REGION = 1024
+EXTERNAL_FLAG = 0x80
+STREAM_SLICE_SIZE = 2 ** 20  # 把整个文件交给压缩器时每次写入的大小
+
+_HEADER_STRUCT = struct.Struct('>1024I')
+_CHUNK_HEADER_STRUCT = struct.Struct('>IB')
+
+
+class ChunkView(NamedTuple):
+    index: int  # 区块在区域文件中的序号，0 ~ 1023
+    x: int  # 区块的绝对坐标，文件名不是 r.<x>.<z>.mca 时为区域内的相对坐标
+    z: int
+    timestamp: int
+    compression: int  # 去掉外部存储标记后的压缩类型
+    external: bool  # 数据是否来自 .mcc 文件
+    data: memoryview
+    source: Optional['MappedFile'] = None  # 外部区块对应的 .mcc 映射，随 release 一起关闭
+
+    def release(self):
+        """释放数据切片，外部区块还会关闭为它映射的 .mcc 文件"""
+        self.data.release()
+        if self.source is not None:
+            self.source.close()
+
+
+class MappedFile:
+    """只读映射整个文件，view 为覆盖整个文件的 memoryview，空文件的 view 长度为 0"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__file = open(path, 'rb')
+        self.__mmap: Optional[mmap.mmap] = None
+        try:
+            size = os.fstat(self.__file.fileno()).st_size
+            if size > 0:
+                self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.__mmap)
+            else:
+                self.view = memoryview(b'')
+        except Exception:
+            self.__file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def iter_slices(self, size: int = STREAM_SLICE_SIZE) -> Iterator[memoryview]:
+        for offset in range(0, len(self.view), size):
+            yield self.view[offset: offset + size]
+
+    def close(self):
+        self.view.release()
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                pass  # 还有切片没有释放，等它们被回收后 mmap 会自动关闭
+            self.__mmap = None
+        self.__file.close()
+
+
+class RegionFile(MappedFile):
+    """区域文件，解析文件头并按需提供各个区块的零拷贝视图"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.region_x, self.region_z = parse_region_coords(path)
+        if len(self.view) >= HEADER_SIZE:
+            self.locations = _HEADER_STRUCT.unpack_from(self.view, 0)
+            self.timestamps = _HEADER_STRUCT.unpack_from(self.view, SECTOR_SIZE)
+        else:
+            # 空文件或损坏的文件，视为没有任何区块
+            self.locations = self.timestamps = (0,) * CHUNKS_PER_REGION
+
+    def chunk_coords(self, index: int) -> Tuple[int, int]:
+        return self.region_x * 32 + index % 32, self.region_z * 32 + index // 32
+
+    def chunk(self, index: int) -> Optional[ChunkView]:
+        """
+        获取区块数据的视图，区块不存在或数据损坏时返回 None
+        外部 .mcc 区块会额外映射对应的文件，用完后需要调用 ChunkView.release 关闭
+        """
+        location = self.locations[index]
+        sector, count = location >> 8, location & 0xFF
+        if sector < 2 or count == 0:
+            return None
+        offset = sector * SECTOR_SIZE
+        if offset + _CHUNK_HEADER_STRUCT.size > len(self.view):
+            return None
+        length, compression = _CHUNK_HEADER_STRUCT.unpack_from(self.view, offset)
+        x, z = self.chunk_coords(index)
+        if compression & EXTERNAL_FLAG:
+            mcc_path = os.path.join(os.path.dirname(self.path), f'c.{x}.{z}.mcc')
+            if not os.path.isfile(mcc_path):
+                return None
+            mcc = MappedFile(mcc_path)
+            return ChunkView(index, x, z, self.timestamps[index], compression & ~EXTERNAL_FLAG, True, mcc.view, mcc)
+        end = offset + 4 + length
+        if length == 0 or end > len(self.view):
+            return None
+        return ChunkView(index, x, z, self.timestamps[index], compression, False, self.view[offset + 5: end])
+
+    def iter_chunks(self) -> Iterator[ChunkView]:
+        """逐个提供区块视图，视图只在本次迭代内有效，进入下一个区块前会被释放"""
+        for index in range(CHUNKS_PER_REGION):
+            chunk = self.chunk(index)
+            if chunk is not None:
+                try:
+                    yield chunk
+                finally:
+                    chunk.release()
+
+
+def parse_region_coords(path: str) -> Tuple[int, int]:
+    """从 r.<x>.<z>.mca 形式的文件名中解析区域坐标，无法解析时返回 (0, 0)"""
+    parts = os.path.basename(path).split('.')
+    if len(parts) == 4 and parts[0] == 'r':
+        try:
+            return int(parts[1]), int(parts[2])
+        except ValueError:
+            pass
+    return 0, 0
+
+
+def is_region_file(path: str) -> bool:
+    return path.endswith('.mca') or path.endswith('.mcc')
+
+
+HasherFactory = Callable[[], 'hashlib._Hash']
+
+
+def hash_file(path: str, hasher_factory: HasherFactory = hashlib.blake2b) -> str:
+    """对整个文件计算摘要，数据直接从映射中读取"""
+    hasher = hasher_factory()
+    with MappedFile(path) as mapped:
+        for piece in mapped.iter_slices():
+            hasher.update(piece)
+            piece.release()
+    return hasher.hexdigest()
+
+
+def hash_region_chunks(path: str, hasher_factory: HasherFactory = hashlib.blake2b) -> Dict[int, Tuple[int, str]]:
+    """对区域文件中的每个区块分别计算摘要，返回 {区块序号: (时间戳, 摘要)}，可用于找出发生变化的区块"""
+    result = {}
+    with RegionFile(path) as region:
+        for chunk in region.iter_chunks():
+            hasher = hasher_factory()
+            hasher.update(chunk.data)
+            result[chunk.index] = (chunk.timestamp, hasher.hexdigest())
+            chunk.release()
+    return result
+
+
+def write_mapped_to_zip(zf, file_path: str, arcname: str, compression: int, on_progress: Optional[Callable[[int], None]] = None):
+    """把文件的映射按块交给 zip 的压缩器，不经过中间的 bytes 对象，并在每块写入后报告进度"""
+    import zipfile
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = compression
+    with MappedFile(file_path) as mapped, zf.open(zinfo, 'w') as dst:
+        for piece in mapped.iter_slices():
+            dst.write(piece)
+            if on_progress is not None:
+                on_progress(len(piece))
+            piece.release()
+
+
+def _benchmark_plain(path: str) -> Tuple[int, int]:
+    """对照组：用普通的 read() 逐个读取区块并计算摘要"""
+    size = 0
+    count = 0
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return 0, 0
+        for location in _HEADER_STRUCT.unpack_from(header, 0):
+            sector, sectors = location >> 8, location & 0xFF
+            if sector < 2 or sectors == 0:
+                continue
+            f.seek(sector * SECTOR_SIZE)
+            chunk_header = f.read(5)
+            if len(chunk_header) < 5:
+                continue
+            length, compression = _CHUNK_HEADER_STRUCT.unpack(chunk_header)
+            if compression & EXTERNAL_FLAG or length == 0:
+                continue
+            data = f.read(length - 1)
+            hashlib.blake2b(data).hexdigest()
+            size += len(data)
+            count += 1
+    return size, count
+
+
+def _benchmark_mapped(path: str) -> Tuple[int, int]:
+    size = 0
+    count = 0
+    with RegionFile(path) as region:
+        for chunk in region.iter_chunks():
+            if chunk.external:
+                chunk.release()
+                continue
+            hashlib.blake2b(chunk.data).hexdigest()
+            size += len(chunk.data)
+            count += 1
+            chunk.release()
+    return size, count
+
+
+def benchmark(world_path: str, rounds: int = 3):
+    """比较普通读取和内存映射读取区域文件并逐区块计算摘要的速度"""
+    files = []
+    for root, _, names in os.walk(world_path):
+        files.extend(os.path.join(root, name) for name in names if name.endswith('.mca'))
+    total_size = sum(os.path.getsize(path) for path in files)
+    print(f'{len(files)} region files, {round(total_size / 2 ** 20, 1)} MB')
+    for name, func in (('read()', _benchmark_plain), ('mmap', _benchmark_mapped)):
+        best = None
+        size = count = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            size = count = 0
+            for path in files:
+                s, c = func(path)
+                size += s
+                count += c
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        speed = size / 2 ** 20 / best if best > 0 else 0
+        print(f'{name:>8}: {count} chunks, {round(size / 2 ** 20, 1)} MB, best of {rounds}: {round(best, 3)}s, {round(speed, 1)} MB/s')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark region file reading: read() vs mmap')
+    parser.add_argument('world', help='path to a world folder containing region files')
+    parser.add_argument('-r', '--rounds', type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.world, args.rounds)
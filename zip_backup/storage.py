@@ -0,0 +1,361 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Optional
+
+'''
+备份文件的存储后端
+
+所有后端都按"分块上传"的方式工作：文件被切成固定大小的块，由线程池并发上传，
+每完成一块就把进度写入备份文件旁边的 <备份文件>.upload.json，
+传输中断后再次上传同一个文件时会跳过已经完成的块。
+'''
+
+UPLOAD_STATE_SUFFIX = '.upload.json'
+PART_RETRY_TIMES = 3
+
+ProgressCallback = Callable[[int], Any]
+
+
+class StorageBackend:
+    """存储后端基类，子类只需要实现分块上传的几个步骤"""
+    name = 'base'
+    min_part_size = 1
+
+    def __init__(self, part_size: int = 16 * 2 ** 20, concurrency: int = 4):
+        self.part_size = max(part_size, self.min_part_size)
+        self.concurrency = max(1, concurrency)
+
+    def describe(self, remote_name: str) -> str:
+        """返回目标位置的可读描述，同时用于判断续传记录是否属于同一个目标"""
+        raise NotImplementedError()
+
+    def open_upload(self, remote_name: str, size: int, state: dict) -> bool:
+        """
+        开始（或继续）一次上传，后端自己的续传信息保存在 state 中
+        返回 False 表示之前上传的块已经失效，需要全部重新上传
+        """
+        raise NotImplementedError()
+
+    def upload_part(self, remote_name: str, state: dict, number: int, offset: int, data: bytes) -> str:
+        """上传编号为 number（从 1 开始）的块，返回该块的标识（如 S3 的 ETag）"""
+        raise NotImplementedError()
+
+    def complete_upload(self, remote_name: str, state: dict, parts: Dict[int, str]):
+        """所有块上传完成后合并成最终文件"""
+        raise NotImplementedError()
+
+    def abort_upload(self, remote_name: str, state: dict):
+        """放弃一次未完成的上传并清理已经上传的块，续传记录失效时调用"""
+        pass
+
+    def close(self):
+        pass
+
+    def upload(self, local_file: str, remote_name: Optional[str] = None, on_progress: Optional[ProgressCallback] = None) -> str:
+        """并发分块上传文件，支持断点续传，返回目标位置描述"""
+        if remote_name is None:
+            remote_name = os.path.basename(local_file)
+        stat = os.stat(local_file)
+        size = stat.st_size
+        state_file = local_file + UPLOAD_STATE_SUFFIX
+        target = self.describe(remote_name)
+
+        state = load_upload_state(state_file)
+        if state is None or state.get('target') != target or state.get('size') != size \
+                or state.get('mtime') != stat.st_mtime or state.get('part_size') != self.part_size:
+            if state is not None and state.get('backend'):
+                self.abort_upload(remote_name, state['backend'])
+            state = {'target': target, 'size': size, 'mtime': stat.st_mtime, 'part_size': self.part_size, 'backend': {}, 'parts': {}}
+        if not self.open_upload(remote_name, size, state['backend']):
+            state['parts'] = {}
+        save_upload_state(state_file, state)
+
+        part_count = max(1, -(-size // self.part_size))
+        pending = [n for n in range(1, part_count + 1) if str(n) not in state['parts']]
+        if on_progress is not None and len(pending) < part_count:
+            done = sum(min(self.part_size, size - (int(n) - 1) * self.part_size) for n in state['parts'])
+            on_progress(done)
+
+        lock = threading.Lock()
+        failed = threading.Event()
+
+        def run(number: int):
+            if failed.is_set():
+                return
+            offset = (number - 1) * self.part_size
+            length = min(self.part_size, size - offset)
+            with open(local_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            try:
+                tag = self.__upload_part_with_retry(remote_name, state['backend'], number, offset, data)
+            except Exception:
+                failed.set()
+                raise
+            with lock:
+                state['parts'][str(number)] = tag
+                save_upload_state(state_file, state)
+            if on_progress is not None:
+                on_progress(length)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ZipBackup-Upload') as pool:
+            futures = [pool.submit(run, n) for n in pending]
+            for future in as_completed(futures):
+                future.result()
+
+        self.complete_upload(remote_name, state['backend'], {int(n): tag for n, tag in state['parts'].items()})
+        remove_upload_state(state_file)
+        return target
+
+    def __upload_part_with_retry(self, remote_name: str, state: dict, number: int, offset: int, data: bytes) -> str:
+        for i in range(PART_RETRY_TIMES):
+            try:
+                return self.upload_part(remote_name, state, number, offset, data)
+            except Exception:
+                if i == PART_RETRY_TIMES - 1:
+                    raise
+                time.sleep(2 ** i)
+
+
+class LocalStorage(StorageBackend):
+    """本地目录或挂载的 NFS 目录，先写入 .part 文件，完成后原子地重命名"""
+    name = 'local'
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def __target(self, remote_name: str) -> str:
+        return os.path.join(self.path, remote_name)
+
+    def describe(self, remote_name: str) -> str:
+        return os.path.abspath(self.__target(remote_name))
+
+    def open_upload(self, remote_name: str, size: int, state: dict) -> bool:
+        os.makedirs(self.path, exist_ok=True)
+        temp_file = self.__target(remote_name) + '.part'
+        if os.path.isfile(temp_file) and os.path.getsize(temp_file) == size:
+            return True
+        with open(temp_file, 'wb') as f:
+            f.truncate(size)
+        return False
+
+    def upload_part(self, remote_name: str, state: dict, number: int, offset: int, data: bytes) -> str:
+        with open(self.__target(remote_name) + '.part', 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return ''
+
+    def complete_upload(self, remote_name: str, state: dict, parts: Dict[int, str]):
+        target = self.__target(remote_name)
+        os.replace(target + '.part', target)
+
+
+def load_private_key(key_file: str):
+    """依次尝试 Ed25519、ECDSA、RSA 格式读取私钥，OpenSSH 现在默认生成的是 Ed25519 密钥"""
+    import paramiko
+    for key_class in (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey):
+        try:
+            return key_class.from_private_key_file(key_file)
+        except paramiko.PasswordRequiredException:
+            raise RuntimeError(f'私钥 {key_file} 有密码保护，请使用没有密码的私钥') from None
+        except paramiko.SSHException:
+            continue
+    raise RuntimeError(f'无法读取私钥 {key_file}，仅支持 Ed25519、ECDSA、RSA 格式')
+
+
+class SftpStorage(StorageBackend):
+    """SFTP 服务器，上传线程从最多 concurrency 个 SFTP 会话中借用一个，整个后端共用这些会话"""
+    name = 'sftp'
+
+    def __init__(self, host: str, path: str, port: int = 22, username: str = '', password: str = '', key_file: str = '', **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import paramiko
+        except ImportError:
+            raise RuntimeError('使用 SFTP 存储需要先安装 paramiko：pip install paramiko') from None
+        self.host = host
+        self.port = port
+        self.path = path.rstrip('/') or '/'
+        self.__transport = paramiko.Transport((host, port))
+        try:
+            self.__transport.connect(
+                username=username or None,
+                password=password or None,
+                pkey=load_private_key(key_file) if key_file else None
+            )
+        except Exception:
+            self.__transport.close()
+            raise
+        self.__sessions = []  # 所有打开的会话
+        self.__idle_sessions = []  # 当前没有被使用的会话
+        self.__sessions_lock = threading.Lock()
+
+    @contextmanager
+    def __sftp(self):
+        """借用一个空闲的会话，没有时新建；同时使用的线程不超过 concurrency 个，所以会话数量也不会超过它"""
+        with self.__sessions_lock:
+            sftp = self.__idle_sessions.pop() if len(self.__idle_sessions) > 0 else None
+        if sftp is None:
+            import paramiko
+            sftp = paramiko.SFTPClient.from_transport(self.__transport)
+            with self.__sessions_lock:
+                self.__sessions.append(sftp)
+        try:
+            yield sftp
+        finally:
+            with self.__sessions_lock:
+                self.__idle_sessions.append(sftp)
+
+    def __target(self, remote_name: str) -> str:
+        return self.path + '/' + remote_name
+
+    def describe(self, remote_name: str) -> str:
+        return f'sftp://{self.host}:{self.port}{self.__target(remote_name)}'
+
+    def open_upload(self, remote_name: str, size: int, state: dict) -> bool:
+        with self.__sftp() as sftp:
+            current = ''
+            for folder in self.path.split('/'):
+                current = current + folder + '/'
+                try:
+                    sftp.stat(current)
+                except IOError:
+                    sftp.mkdir(current)
+            temp_file = self.__target(remote_name) + '.part'
+            try:
+                sftp.stat(temp_file)
+                return True
+            except IOError:
+                sftp.open(temp_file, 'wb').close()
+                return False
+
+    def upload_part(self, remote_name: str, state: dict, number: int, offset: int, data: bytes) -> str:
+        with self.__sftp() as sftp, sftp.open(self.__target(remote_name) + '.part', 'r+b') as f:
+            f.set_pipelined(True)
+            f.seek(offset)
+            f.write(data)
+        return ''
+
+    def complete_upload(self, remote_name: str, state: dict, parts: Dict[int, str]):
+        target = self.__target(remote_name)
+        with self.__sftp() as sftp:
+            sftp.posix_rename(target + '.part', target)
+
+    def close(self):
+        with self.__sessions_lock:
+            for sftp in self.__sessions:
+                sftp.close()
+            self.__sessions.clear()
+            self.__idle_sessions.clear()
+        self.__transport.close()
+
+
+class S3Storage(StorageBackend):
+    """S3 兼容的对象存储（AWS S3、MinIO 等），使用原生的分段上传"""
+    name = 's3'
+    min_part_size = 5 * 2 ** 20  # S3 要求除最后一段外每段至少 5MB
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = '', access_key: str = '', secret_key: str = '', region: str = '', client=None, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError('使用 S3 存储需要先安装 boto3：pip install boto3') from None
+            client = boto3.client(
+                's3',
+                endpoint_url=endpoint_url or None,
+                aws_access_key_id=access_key or None,
+                aws_secret_access_key=secret_key or None,
+                region_name=region or None
+            )
+        self.client = client
+
+    def __key(self, remote_name: str) -> str:
+        return f'{self.prefix}/{remote_name}' if self.prefix else remote_name
+
+    def describe(self, remote_name: str) -> str:
+        return f's3://{self.bucket}/{self.__key(remote_name)}'
+
+    def open_upload(self, remote_name: str, size: int, state: dict) -> bool:
+        key = self.__key(remote_name)
+        if state.get('upload_id'):
+            try:
+                self.client.list_parts(Bucket=self.bucket, Key=key, UploadId=state['upload_id'])
+                return True
+            except Exception:
+                pass  # 分段上传已过期或被清理，重新开始
+        self.abort_upload(remote_name, state)
+        state['upload_id'] = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+        state['bucket'], state['key'] = self.bucket, key
+        return False
+
+    def abort_upload(self, remote_name: str, state: dict):
+        """中止旧的分段上传，否则已经上传的段会一直留在存储桶里占用空间"""
+        upload_id = state.pop('upload_id', None)
+        if not upload_id:
+            return
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=state.get('bucket', self.bucket), Key=state.get('key', self.__key(remote_name)), UploadId=upload_id
+            )
+        except Exception:
+            pass  # 分段上传已过期或已被清理
+
+    def upload_part(self, remote_name: str, state: dict, number: int, offset: int, data: bytes) -> str:
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.__key(remote_name),
+            PartNumber=number, UploadId=state['upload_id'], Body=data
+        )
+        return response['ETag']
+
+    def complete_upload(self, remote_name: str, state: dict, parts: Dict[int, str]):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.__key(remote_name), UploadId=state['upload_id'],
+            MultipartUpload={'Parts': [{'ETag': tag, 'PartNumber': n} for n, tag in sorted(parts.items())]}
+        )
+
+
+BACKENDS = {
+    LocalStorage.name: LocalStorage,
+    SftpStorage.name: SftpStorage,
+    S3Storage.name: S3Storage,
+}
+
+
+def create_backend(name: str, options: Dict[str, Any], *, part_size: int, concurrency: int) -> StorageBackend:
+    """根据名称和配置创建存储后端"""
+    if name not in BACKENDS:
+        raise ValueError(f'未知的存储后端：{name}，可选值：{", ".join(BACKENDS)}')
+    return BACKENDS[name](part_size=part_size, concurrency=concurrency, **options)
+
+
+def load_upload_state(state_file: str) -> Optional[dict]:
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_upload_state(state_file: str, state: dict):
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_file, state_file)
+
+
+def remove_upload_state(state_file: str):
+    try:
+        os.remove(state_file)
+    except FileNotFoundError:
+        pass